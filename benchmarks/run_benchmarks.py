@@ -0,0 +1,329 @@
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from synthetic_dataset import generate
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Scripts in the order a post-collection run uses them, with their command-line arguments
+SCRIPTS = {
+    "compute_metrics": ["compute_metrics.py"],
+    "create_train_val_test_split": ["create_train_val_test_split.py"],
+    "discrete_heatmap": ["discrete_heatmap.py"],
+    "reconcile_dataset": ["reconcile_dataset.py", "--dry-run"],
+}
+
+# Files in dataset/splits/<city> that the generator writes; everything else there is script output
+INPUT_FILES = {"samples.csv", "ground_metadata.csv"}
+
+def reset_outputs(root):
+    """Remove what earlier script runs wrote, so every run starts from the same inputs"""
+    splits_path = os.path.join(root, "dataset", "splits")
+    for city in os.listdir(splits_path):
+        for name in os.listdir(os.path.join(splits_path, city)):
+            path = os.path.join(splits_path, city, name)
+            if name in INPUT_FILES:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    for name in ("manifest.sqlite", "summary_heatmap.html", "profile"):
+        path = os.path.join(root, "dataset", name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+def default_memory_limit():
+    """Half of physical memory in MB, leaving the rest for the host"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2 // (1 << 20)
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+def limit_memory(memory_limit):
+    """preexec_fn capping the child's address space, so a runaway script fails instead of exhausting the host"""
+    def preexec():
+        limit = memory_limit * (1 << 20)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return preexec if memory_limit else None
+
+def run_process(command, cwd, timeout, memory_limit=0):
+    """Run a command, returning wall seconds, peak RSS in MB and "ok", "timeout" or "oom"
+
+    Wall time and peak RSS are None unless the run finished.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, preexec_fn=limit_memory(memory_limit),
+    )
+
+    # wait4 reports the child's own peak RSS; it isn't available on Windows
+    if not hasattr(os, "wait4"):
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            return None, None, "timeout"
+        return time.perf_counter() - start, None, "ok"
+
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        if time.perf_counter() - start > timeout:
+            process.kill()
+            os.wait4(process.pid, 0)
+            return None, None, "timeout"
+        time.sleep(0.02)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        stderr = process.stderr.read().decode(errors="replace")
+        # Allocations past RLIMIT_AS surface as MemoryError, or kill the process outright from C code
+        if memory_limit and ("MemoryError" in stderr or "Cannot allocate memory" in stderr or process.returncode < 0):
+            return None, None, "oom"
+        print(stderr, file=sys.stderr)
+        raise RuntimeError(f"{' '.join(command)} exited with {process.returncode}")
+    return wall, usage.ru_maxrss / 1024, "ok"
+
+class StageTimer:
+    """Accumulate wall time, or with trace the peak traced memory, per named stage
+
+    Tracing slows allocation-heavy code several times over, so times and peaks come from separate passes.
+    """
+
+    def __init__(self, results_path, trace=False):
+        self.results_path = results_path
+        self.trace = trace
+        self.results = {}
+        if trace:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        if self.trace:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+        wall = time.perf_counter() - start
+
+        if self.trace:
+            self.results[name] = max(self.results.get(name, 0.0), tracemalloc.get_traced_memory()[1] / 1e6)
+        else:
+            self.results[name] = self.results.get(name, 0.0) + wall
+
+        # Written after every stage so a timeout still leaves the stages that finished
+        with open(self.results_path, "w") as f:
+            json.dump(self.results, f)
+
+def compute_metrics_stages(timer, city_names):
+    import compute_metrics
+
+    for city in city_names:
+        with timer.measure("read_samples"):
+            lines, bbox_dict = compute_metrics.read_samples(os.path.join("dataset", "splits", city, "samples.csv"))
+        with timer.measure("analyze_image_diversity"):
+            compute_metrics.analyze_image_diversity(lines)
+        with timer.measure("calculate_density_metrics"):
+            compute_metrics.calculate_density_metrics(bbox_dict, city)
+        with timer.measure("geographic_distribution_analysis"):
+            compute_metrics.geographic_distribution_analysis(bbox_dict)
+        # The pairwise loop is quadratic in samples, so it gets its own stage
+        with timer.measure("compute_pairwise_overlaps"):
+            aer_overlap_dict, gl_overlap_dict = compute_metrics.compute_pairwise_overlaps(lines, bbox_dict)
+        with timer.measure("compute_redundancy_scores"):
+            compute_metrics.compute_redundancy_scores(aer_overlap_dict)
+        del aer_overlap_dict, gl_overlap_dict
+
+def create_train_val_test_split_stages(timer, city_names):
+    import create_train_val_test_split as split
+
+    for city in city_names:
+        city_splits_path = os.path.join("dataset", "splits", city)
+        labels = split.load_region_labels(city, city_splits_path)
+        state = split.load_state(city_splits_path)
+        with timer.measure("filter_new_samples"):
+            split.filter_new_samples(city, city_splits_path, state)
+        with timer.measure("split_new_samples"):
+            split.split_new_samples(city, city_splits_path, state, labels)
+        with timer.measure("create_split_map"):
+            split.create_split_map(city, city_splits_path, labels)
+
+def discrete_heatmap_stages(timer, city_names):
+    import discrete_heatmap
+    from sample_cache import load_sample_bboxes
+
+    for city in city_names:
+        with timer.measure("load_sample_bboxes"):
+            bboxes = load_sample_bboxes(os.path.join("dataset", "splits", city, "samples.csv"))
+        with timer.measure("count_cells"):
+            cell_counts = discrete_heatmap.count_cells(bboxes, discrete_heatmap.cities[city])
+        with timer.measure("color_cells"):
+            discrete_heatmap.color_cells(cell_counts)
+        with timer.measure("create_discrete_heatmap"):
+            discrete_heatmap.create_discrete_heatmap(city)
+
+def reconcile_dataset_stages(timer, city_names):
+    import reconcile_dataset
+
+    for city in city_names:
+        with timer.measure("referenced_files"):
+            aerial, ground = reconcile_dataset.referenced_files(os.path.join("dataset", "splits", city))
+        with timer.measure("find_orphans"):
+            reconcile_dataset.find_orphans(os.path.join("dataset", city, "aerial"), aerial)
+            reconcile_dataset.find_orphans(os.path.join("dataset", city, "ground"), ground)
+
+STAGES = {
+    "compute_metrics": compute_metrics_stages,
+    "create_train_val_test_split": create_train_val_test_split_stages,
+    "discrete_heatmap": discrete_heatmap_stages,
+    "reconcile_dataset": reconcile_dataset_stages,
+}
+
+def run_stages(script, results_path, trace=False):
+    """Entry point of the stage subprocess: time, or trace, each stage of a script in the current directory"""
+    city_names = sorted(os.listdir(os.path.join("dataset", "splits")))
+    STAGES[script](StageTimer(results_path, trace), city_names)
+
+def measure_stages(root, script, trace, timeout, memory_limit):
+    """Run one stage pass in a subprocess, returning each finished stage's wall seconds or traced peak MB"""
+    reset_outputs(root)
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        stages_path = f.name
+    try:
+        # Stages that finished before a timeout or out-of-memory are still reported
+        run_process(
+            [sys.executable, os.path.abspath(__file__), "--stages", script, "--stages-output", stages_path]
+            + (["--stages-trace"] if trace else []),
+            root,
+            timeout,
+            memory_limit,
+        )
+        with open(stages_path, "r") as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return {}
+    finally:
+        os.remove(stages_path)
+
+def benchmark_size(root, scripts, timeout, memory_limit):
+    """Time every script, then each of its stages, against one generated dataset"""
+    results = {}
+    for script in scripts:
+        reset_outputs(root)
+        wall, peak_mb, status = run_process(
+            [sys.executable] + [os.path.join(REPO_ROOT, SCRIPTS[script][0])] + SCRIPTS[script][1:], root, timeout, memory_limit,
+        )
+        result = {"wall": wall, "peak_mb": peak_mb, "status": status, "stages": {}}
+
+        for key, trace in (("wall", False), ("peak_mb", True)):
+            for name, value in measure_stages(root, script, trace, timeout, memory_limit).items():
+                result["stages"].setdefault(name, {"wall": None, "peak_mb": None})[key] = value
+
+        results[script] = result
+        summary = f"{wall:.2f}s" if status == "ok" else {"timeout": "timed out", "oom": "out of memory"}[status]
+        print(f"  {script}: {summary}" + (f", {peak_mb:.0f} MB peak" if peak_mb else ""))
+        for name, stage in result["stages"].items():
+            stage_wall = "unfinished" if stage["wall"] is None else f"{stage['wall']:.2f}s"
+            stage_peak = "unfinished" if stage["peak_mb"] is None else f"{stage['peak_mb']:.0f} MB"
+            print(f"    {name}: {stage_wall}, {stage_peak} traced peak")
+    reset_outputs(root)
+    return results
+
+def compare(results, baseline, threshold):
+    """Print each measurement against the baseline, returning whether anything regressed past threshold"""
+    regressed = False
+    for size, scripts in results.items():
+        for script, result in scripts.items():
+            base = baseline.get(size, {}).get(script)
+            if not base:
+                continue
+            measurements = [(script, "wall", result["wall"], base["wall"]), (script, "peak_mb", result["peak_mb"], base["peak_mb"])]
+            measurements += [
+                (f"{script}.{name}", key, stage[key], base["stages"][name][key])
+                for name, stage in result["stages"].items() if name in base.get("stages", {})
+                for key in ("wall", "peak_mb")
+            ]
+            for name, key, value, base_value in measurements:
+                if value is None and base_value is not None:
+                    failure = {"timeout": "timed out", "oom": "out of memory"}.get(result.get("status"), "failed")
+                    print(f"REGRESSION {size} samples {name} {key}: {failure}, baseline {base_value:.2f}")
+                    regressed = True
+                elif value is not None and base_value and value > base_value * (1 + threshold):
+                    print(f"REGRESSION {size} samples {name} {key}: {value:.2f} vs baseline {base_value:.2f}")
+                    regressed = True
+    return regressed
+
+def main():
+    """Benchmark the post-processing scripts on synthetic datasets and compare against a stored baseline."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Samples per dataset")
+    parser.add_argument("--cities", type=int, default=1, help="Cities the samples are spread over")
+    parser.add_argument("--scripts", nargs="+", default=list(SCRIPTS), choices=list(SCRIPTS))
+    parser.add_argument("--no-images", action="store_true", help="Generate datasets without placeholder images")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds before a script run is abandoned")
+    parser.add_argument(
+        "--memory-limit", type=int, default=default_memory_limit(),
+        help="Address space limit per run in MB, recorded as out of memory when hit (0 for none)",
+    )
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "cmvpe_benchmarks"))
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown or growth before flagging")
+    parser.add_argument("--stages", help=argparse.SUPPRESS)
+    parser.add_argument("--stages-output", help=argparse.SUPPRESS)
+    parser.add_argument("--stages-trace", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stages:
+        run_stages(args.stages, args.stages_output, args.stages_trace)
+        return
+
+    results = {}
+    for size in args.sizes:
+        root = os.path.join(args.work_dir, f"{size}_{args.cities}{'_no_images' if args.no_images else ''}")
+        if not os.path.exists(os.path.join(root, "generated")):
+            print(f"Generating {size} samples in {root}...")
+            shutil.rmtree(root, ignore_errors=True)
+            generate(root, size, args.cities, not args.no_images)
+            open(os.path.join(root, "generated"), "w").close()
+
+        print(f"Benchmarking {size} samples:")
+        results[str(size)] = benchmark_size(root, args.scripts, args.timeout, args.memory_limit)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        for size, scripts in results.items():
+            baseline.setdefault(size, {}).update(scripts)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
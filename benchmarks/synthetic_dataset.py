@@ -0,0 +1,112 @@
+import argparse
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_dataset import GL_SAMPLES_MAX, R_EARTH, SIDE_LENGTH
+from discrete_heatmap import cities
+from manifest import GROUND_COLUMNS
+
+# Samples generated and written per batch, bounding memory for large datasets
+CHUNK_SAMPLES = 50000
+
+def placeholder_bytes(image_format, size):
+    """Encoded bytes of a small solid image, reused for every placeholder file"""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (127, 127, 127)).save(buffer, image_format)
+    return buffer.getvalue()
+
+def generate_city(root, city, n_samples, rng, images=True, max_ground=GL_SAMPLES_MAX):
+    """Write samples.csv, ground_metadata.csv and placeholder images for one city, using the real naming"""
+    west, south, east, north = cities[city]
+    city_splits_path = os.path.join(root, "dataset", "splits", city)
+    aerial_path = os.path.join(root, "dataset", city, "aerial")
+    ground_path = os.path.join(root, "dataset", city, "ground")
+    for path in (city_splits_path, aerial_path, ground_path):
+        os.makedirs(path, exist_ok=True)
+
+    aerial_bytes = placeholder_bytes("PNG", (512, 512)) if images else None
+    ground_bytes = placeholder_bytes("JPEG", (64, 48)) if images else None
+
+    next_id = int(rng.integers(10 ** 14, 10 ** 15))
+    with (
+        open(os.path.join(city_splits_path, "samples.csv"), "w", newline="") as f_samples,
+        open(os.path.join(city_splits_path, "ground_metadata.csv"), "w", newline="") as f_metadata,
+    ):
+        f_metadata.write(",".join(GROUND_COLUMNS) + "\r\n")
+
+        for start in range(0, n_samples, CHUNK_SAMPLES):
+            n = min(CHUNK_SAMPLES, n_samples - start)
+            latitude = rng.uniform(south, north, n)
+            longitude = rng.uniform(west, east, n)
+            lat_delta = (SIDE_LENGTH / R_EARTH) * (180 / np.pi) / 2
+            lng_delta = (SIDE_LENGTH / R_EARTH) * (180 / np.pi) / np.cos(latitude * (np.pi / 180)) / 2
+            counts = rng.integers(1, max_ground + 1, n)
+
+            # Ground-level images scatter over the whole aerial tile, so about a quarter pass the comp filter
+            total = int(counts.sum())
+            ids = np.arange(next_id, next_id + total, dtype=np.int64)
+            next_id += total
+            owner = np.repeat(np.arange(n), counts)
+            gl_lat = latitude[owner] + rng.uniform(-1, 1, total) * lat_delta
+            gl_lng = longitude[owner] + rng.uniform(-1, 1, total) * lng_delta[owner]
+            captured_at = rng.integers(1_400_000_000_000, 1_750_000_000_000, total)
+            angle = rng.uniform(0, 360, total)
+            rotation = rng.normal(0, 1, (total, 3))
+
+            sample_lines = []
+            metadata_lines = []
+            offset = 0
+            for i in range(n):
+                aer_image_name = (
+                    f"aerial_{longitude[i] - lng_delta[i]}_{latitude[i] - lat_delta}_"
+                    f"{longitude[i] + lng_delta[i]}_{latitude[i] + lat_delta}.png"
+                )
+                gl_image_names = [f"{gl_id}.jpg" for gl_id in ids[offset:offset + counts[i]].tolist()]
+                offset += counts[i]
+                sample_lines.append(",".join([aer_image_name] + gl_image_names) + "\r\n")
+
+                if images:
+                    with open(os.path.join(aerial_path, aer_image_name), "wb") as f:
+                        f.write(aerial_bytes)
+                    for gl_image_name in gl_image_names:
+                        with open(os.path.join(ground_path, gl_image_name), "wb") as f:
+                            f.write(ground_bytes)
+
+            for k in range(total):
+                metadata_lines.append(
+                    f"{ids[k]},{captured_at[k]},480,seq{owner[k] + start},10.0,10.0,{angle[k]},{angle[k]},"
+                    f"{gl_lat[k]},{gl_lng[k]},{gl_lat[k]},{gl_lng[k]},"
+                    f"{rotation[k, 0]},{rotation[k, 1]},{rotation[k, 2]},0.8,0.0,0.0\r\n"
+                )
+
+            f_samples.writelines(sample_lines)
+            f_metadata.writelines(metadata_lines)
+
+def generate(root, n_samples, n_cities=1, images=True, seed=0):
+    """Generate a dataset/ tree under root with n_samples samples spread over the first n_cities cities"""
+    rng = np.random.default_rng(seed)
+    city_names = list(cities)[:n_cities]
+    for i, city in enumerate(city_names):
+        city_samples = n_samples // len(city_names) + (1 if i < n_samples % len(city_names) else 0)
+        generate_city(root, city, city_samples, rng, images)
+
+def main():
+    """Generate a synthetic dataset/ tree with the collector's file layout and naming."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("root", help="Directory to create dataset/ in")
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--cities", type=int, default=1)
+    parser.add_argument("--no-images", action="store_true", help="Skip writing placeholder image files")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.root, args.samples, args.cities, not args.no_images, args.seed)
+
+if __name__ == "__main__":
+    main()
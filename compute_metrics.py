@@ -2,6 +2,8 @@ import os
 import numpy as np
 from collections import Counter, defaultdict
 
+import manifest
+
 def compute_overlap(bbox1, bbox2):
     length = max(min(bbox2[2] - bbox1[0], bbox1[2] - bbox2[0]), 0)
     width = max(min(bbox2[3] - bbox1[1], bbox1[3] - bbox2[1]), 0)
@@ -20,7 +22,7 @@ def analyze_image_diversity(samples):
     diversity_stats = {}
     all_ground_images = set()
     
-    for sample in samples[1:]:
+    for sample in samples:
         sample_images = sample.strip().split(',')
         aerial_name = sample_images[0]
         ground_images = sample_images[1:]
@@ -117,23 +119,66 @@ def calculate_density_metrics(bbox_dict, city_name):
     }
 
 
-for city in os.listdir(os.path.join("dataset", "splits")):
-    city_splits_path = os.path.join("dataset", "splits", city)
+def read_samples(samples_path, conn=None, city=None):
+    """Read a samples file, returning its sample lines and each sample's aerial bbox keyed by aerial name
+
+    The bboxes come from the manifest when it holds the city, and from the aerial names otherwise.
+    """
+    with open(samples_path, "r") as f:
+        # samples.csv has no header, so every line naming an aerial image is a sample
+        lines = [line for line in f if line.startswith("aerial_")]
+    if conn is not None and manifest.has_city(conn, city):
+        return lines, manifest.sample_bounds(conn, city)
+
+    bbox_dict = {}
+    for line in lines:
+        aer_image_name = line.strip().split(',')[0]
+        bbox_dict[aer_image_name] = manifest.parse_bbox(aer_image_name)
+    return lines, bbox_dict
+
+def compute_pairwise_overlaps(lines, bbox_dict):
+    """Fraction of each sample's aerial area and ground-level images shared with every other sample"""
     aer_overlap_dict = {}
     gl_overlap_dict = {}
-    
-    print(f"\n=== Analyzing {city} ===")
-    
-    with open(os.path.join(city_splits_path, "samples.csv"), "r") as f:
-        lines = f.readlines()
-        bbox_dict = {}
 
-        for line in lines[1:]:
-            aer_image_name = line.strip().split(',')[0]
+    for sample1 in lines:
+        sample1_images = sample1.strip().split(',')
+        sample1_aerial = sample1_images[0]
+        sample1_gls = set(sample1_images[1:])
+
+        aer_overlap = {}
+        gl_overlap = {}
+
+        sample1_bbox = bbox_dict[sample1_aerial]
+
+        area = (sample1_bbox[2] - sample1_bbox[0]) * (sample1_bbox[3] - sample1_bbox[1])
+
+        for sample2 in lines:
+            sample2_images = sample2.strip().split(',')
+            sample2_aerial = sample2_images[0]
+            sample2_gls = set(sample2_images[1:])
+
+            aer_perc_overlap = compute_overlap(sample1_bbox, bbox_dict[sample2_aerial]) / area
+            gl_perc_overlap = len(sample1_gls & sample2_gls) / len(sample1_gls)
+
+            aer_overlap[sample2_aerial] = aer_perc_overlap
+            gl_overlap[sample2_aerial] = gl_perc_overlap
 
-            bbox = aer_image_name[:-4].split("_")[1:]
-            bbox = [float(edge) for edge in bbox]
-            bbox_dict[aer_image_name] = bbox
+        aer_overlap_dict[sample1_aerial] = aer_overlap
+        gl_overlap_dict[sample1_aerial] = gl_overlap
+
+    return aer_overlap_dict, gl_overlap_dict
+
+
+def main():
+    """Print coverage, diversity, distribution and redundancy metrics for every city."""
+    conn = manifest.connect() if os.path.exists(manifest.MANIFEST_PATH) else None
+    for city in os.listdir(os.path.join("dataset", "splits")):
+        city_splits_path = os.path.join("dataset", "splits", city)
+    
+        print(f"\n=== Analyzing {city} ===")
+    
+        lines, bbox_dict = read_samples(os.path.join(city_splits_path, "samples.csv"), conn, city)
 
         # Check if we have any samples
         if not bbox_dict:
@@ -151,31 +196,7 @@ for city in os.listdir(os.path.join("dataset", "splits")):
         print(f"Geographic Stats: {geo_stats}")
         print(f"Density Stats: {density_stats}")
 
-        for sample1 in lines[1:]:
-            sample1_images = sample1.strip().split(',')
-            sample1_aerial = sample1_images[0]
-            sample1_gls = set(sample1_images[1:])
-
-            aer_overlap = {}
-            gl_overlap = {}
-
-            sample1_bbox = bbox_dict[sample1_aerial]
-
-            area = (sample1_bbox[2] - sample1_bbox[0]) * (sample1_bbox[3] - sample1_bbox[1])
-
-            for sample2 in lines[1:]:
-                sample2_images = sample2.strip().split(',')
-                sample2_aerial = sample2_images[0]
-                sample2_gls = set(sample2_images[1:])
-
-                aer_perc_overlap = compute_overlap(sample1_bbox, bbox_dict[sample2_aerial]) / area
-                gl_perc_overlap = len(sample1_gls & sample2_gls) / len(sample1_gls)
-
-                aer_overlap[sample2_aerial] = aer_perc_overlap
-                gl_overlap[sample2_aerial] = gl_perc_overlap
-
-            aer_overlap_dict[sample1_aerial] = aer_overlap
-            gl_overlap_dict[sample1_aerial] = gl_overlap
+        aer_overlap_dict, gl_overlap_dict = compute_pairwise_overlaps(lines, bbox_dict)
 
         # Calculate redundancy scores
         redundancy_scores, redundant_samples = compute_redundancy_scores(aer_overlap_dict)
@@ -197,6 +218,8 @@ for city in os.listdir(os.path.join("dataset", "splits")):
         for item in aer_overlap_dict:
             print(f"{item}: {sum(aer_overlap_dict[item].values()):.3f}")
     
-    # with open("overlap.csv", "w") as f:
-    #     f.write("")
+        # with open("overlap.csv", "w") as f:
+        #     f.write("")
 
+if __name__ == "__main__":
+    main()
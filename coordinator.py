@@ -0,0 +1,378 @@
+import argparse
+import contextlib
+import csv
+import multiprocessing as mp
+import os
+import shutil
+import socket
+import sqlite3
+import time
+
+import manifest
+from create_dataset import SAMPLES, collect_samples, dedupe_metadata
+from discrete_heatmap import cities
+
+# Shared across collector nodes, so it must sit on a filesystem with working locks (e.g. NFS with lockd)
+STORE_PATH = "coordinator.sqlite"
+SHARDS_PATH = "shards"
+
+# Work units per side of each city's bbox
+UNITS_SIDE = 4
+
+# Candidates a unit may draw per sample of its quota before it is given up, e.g. over open water
+CANDIDATES_PER_SAMPLE = 20
+
+# A node that hasn't renewed its lease for this long is presumed dead and its unit is reclaimed
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    city TEXT NOT NULL,
+    west REAL NOT NULL,
+    south REAL NOT NULL,
+    east REAL NOT NULL,
+    north REAL NOT NULL,
+    quota INTEGER NOT NULL,
+    budget INTEGER NOT NULL,
+    collected INTEGER NOT NULL DEFAULT 0,
+    candidates INTEGER NOT NULL DEFAULT 0,
+    unplaced INTEGER NOT NULL DEFAULT 0,
+    node TEXT,
+    lease_expires REAL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS units_open ON units (done, lease_expires);
+
+CREATE TABLE IF NOT EXISTS nodes (
+    node TEXT PRIMARY KEY,
+    shard TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+"""
+
+def connect(path=STORE_PATH):
+    """Open the coordination store, creating its tables on first use"""
+    # Rollback journal rather than WAL, since WAL needs shared memory that network filesystems don't provide
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+@contextlib.contextmanager
+def transaction(conn):
+    """Hold the store's write lock for the whole block, so reads and updates inside it are atomic"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def plan_units(conn, city_bboxes, samples, units_side=UNITS_SIDE, budget=CANDIDATES_PER_SAMPLE):
+    """Split each city's bbox into a units_side x units_side grid, sharing the city's quota between the cells
+
+    budget is the number of candidates a unit may draw per sample of its quota before it gives up.
+    """
+    with transaction(conn):
+        for city, (west, south, east, north) in city_bboxes.items():
+            if conn.execute("SELECT 1 FROM units WHERE city = ?", [city]).fetchone():
+                continue
+            lng_step = (east - west) / units_side
+            lat_step = (north - south) / units_side
+            for k in range(units_side * units_side):
+                i, j = divmod(k, units_side)
+                quota = samples // units_side ** 2 + (1 if k < samples % units_side ** 2 else 0)
+                if quota == 0:
+                    continue
+                conn.execute(
+                    "INSERT INTO units (city, west, south, east, north, quota, budget) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [city, west + i * lng_step, south + j * lat_step, west + (i + 1) * lng_step, south + (j + 1) * lat_step, quota, budget],
+                )
+
+def lease_unit(conn, node, lease_seconds=LEASE_SECONDS):
+    """Lease an unfinished unit that nobody holds or whose lease has expired, preferring the node's own"""
+    now = time.time()
+    with transaction(conn):
+        unit = conn.execute(
+            "SELECT * FROM units WHERE done = 0 AND (node IS NULL OR node = ? OR lease_expires < ?) "
+            "ORDER BY node = ? DESC, id LIMIT 1",
+            [node, now, node],
+        ).fetchone()
+        if unit is None:
+            return None
+        conn.execute("UPDATE units SET node = ?, lease_expires = ? WHERE id = ?", [node, now + lease_seconds, unit["id"]])
+    return unit
+
+def renew_lease(conn, unit_id, node, collected, candidates, lease_seconds=LEASE_SECONDS):
+    """Extend a lease and record progress, returning False if the lease was lost to another node"""
+    cursor = conn.execute(
+        "UPDATE units SET lease_expires = ?, collected = ?, candidates = ? WHERE id = ? AND node = ? AND done = 0",
+        [time.time() + lease_seconds, collected, candidates, unit_id, node],
+    )
+    return cursor.rowcount == 1
+
+def budget_exhausted(unit, candidates):
+    return candidates >= unit["quota"] * unit["budget"]
+
+def finish_unit(conn, unit_id, node, collected, candidates, lease_seconds=LEASE_SECONDS):
+    """Record a collection pass over a leased unit, returning "done", "gave up", "continue" or "lost"
+
+    A unit whose candidate budget ran out is finished with what it has, and its shortfall goes to the
+    city's unfinished units, or is recorded as unplaced when there are none.
+    """
+    with transaction(conn):
+        unit = conn.execute("SELECT * FROM units WHERE id = ? AND node = ? AND done = 0", [unit_id, node]).fetchone()
+        if unit is None:
+            return "lost"
+
+        if collected < unit["quota"] and not budget_exhausted(unit, candidates):
+            conn.execute(
+                "UPDATE units SET lease_expires = ?, collected = ?, candidates = ? WHERE id = ?",
+                [time.time() + lease_seconds, collected, candidates, unit_id],
+            )
+            return "continue"
+
+        shortfall = max(unit["quota"] - collected, 0)
+        conn.execute(
+            "UPDATE units SET done = 1, lease_expires = NULL, quota = MIN(quota, ?), collected = ?, candidates = ? WHERE id = ?",
+            [collected, collected, candidates, unit_id],
+        )
+        if not shortfall:
+            return "done"
+
+        # Spread the shortfall over the city's unfinished units, which keep their own budget per sample
+        others = [row["id"] for row in conn.execute("SELECT id FROM units WHERE city = ? AND done = 0 ORDER BY id", [unit["city"]])]
+        if not others:
+            conn.execute("UPDATE units SET unplaced = ? WHERE id = ?", [shortfall, unit_id])
+        for k, other_id in enumerate(others):
+            extra = shortfall // len(others) + (1 if k < shortfall % len(others) else 0)
+            conn.execute("UPDATE units SET quota = quota + ? WHERE id = ?", [extra, other_id])
+        return "gave up"
+
+def register_node(conn, node, shard):
+    conn.execute(
+        "INSERT OR REPLACE INTO nodes (node, shard, last_seen) VALUES (?, ?, ?)",
+        [node, os.path.abspath(shard), time.time()],
+    )
+
+def unit_progress(conn):
+    """Per-city (units, finished units, quota, collected, samples no unit could take) totals"""
+    return conn.execute(
+        "SELECT city, COUNT(*), SUM(done), SUM(quota), SUM(MIN(collected, quota)), SUM(unplaced) "
+        "FROM units GROUP BY city ORDER BY city"
+    ).fetchall()
+
+def shard_centres(shards_path, city, bbox, margin):
+    """(latitude, longitude) sample centres any shard already holds within margin degrees of a bbox"""
+    west, south, east, north = bbox
+    centres = []
+    if not os.path.isdir(shards_path):
+        return centres
+    for shard in os.listdir(shards_path):
+        for row in manifest.read_rows(os.path.join(shards_path, shard, "dataset", "splits", city, "samples.csv")):
+            aer_west, aer_south, aer_east, aer_north = manifest.parse_bbox(row[0])
+            latitude, longitude = (aer_south + aer_north) / 2, (aer_west + aer_east) / 2
+            if west - margin <= longitude <= east + margin and south - margin <= latitude <= north + margin:
+                centres.append((latitude, longitude))
+    return centres
+
+def run_node(store_path, shards_path, node, lease_seconds=LEASE_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS):
+    """Lease and collect work units into this node's shard until every unit is finished"""
+    store_path = os.path.abspath(store_path)
+    shards_path = os.path.abspath(shards_path)
+    shard = os.path.join(shards_path, node)
+
+    # The collector writes relative to dataset/, so work from inside the shard
+    os.makedirs(os.path.join(shard, "dataset", "splits"), exist_ok=True)
+    os.chdir(shard)
+    manifest.connect().close()
+
+    conn = connect(store_path)
+    register_node(conn, node, shard)
+
+    manager = mp.Manager()
+    num_lines = mp.Value("i", 0)
+
+    while True:
+        unit = lease_unit(conn, node, lease_seconds)
+        if unit is None:
+            if conn.execute("SELECT 1 FROM units WHERE done = 0").fetchone() is None:
+                break
+            # Everything left is leased elsewhere; wait in case one of those nodes dies
+            time.sleep(heartbeat_seconds)
+            continue
+
+        bbox = [unit["west"], unit["south"], unit["east"], unit["north"]]
+        remaining = unit["quota"] - unit["collected"]
+        print(f"Leased unit {unit['id']} ({unit['city']}), {remaining} samples to go")
+
+        last_heartbeat = time.time()
+
+        def keep_going(successful, candidates):
+            nonlocal last_heartbeat
+            # Stop drawing once the unit's budget is spent; finish_unit then gives the unit up
+            if budget_exhausted(unit, candidates):
+                return False
+            if time.time() - last_heartbeat < heartbeat_seconds:
+                return True
+            last_heartbeat = time.time()
+            register_node(conn, node, shard)
+            return renew_lease(conn, unit["id"], node, unit["collected"] + successful, candidates, lease_seconds)
+
+        # Seed the spatial hash with what this and other shards hold nearby, and resume the Halton
+        # sequence where the unit's previous holder stopped, so a reclaimed unit doesn't redo its points
+        successful, candidates = collect_samples(
+            unit["city"], bbox, remaining, manager, num_lines,
+            candidate_start=unit["candidates"],
+            accepted=shard_centres(shards_path, unit["city"], bbox, unit["north"] - unit["south"]),
+            keep_going=keep_going,
+        )
+
+        collected = unit["collected"] + successful
+        outcome = finish_unit(conn, unit["id"], node, collected, candidates, lease_seconds)
+        if outcome == "done":
+            print(f"Completed unit {unit['id']} ({unit['city']})")
+        elif outcome == "gave up":
+            print(f"Gave up on unit {unit['id']} ({unit['city']}) after {candidates} candidates, {unit['quota'] - collected} samples short")
+        elif outcome == "lost":
+            print(f"Lost the lease on unit {unit['id']} ({unit['city']})")
+
+    conn.close()
+    print("No units left")
+
+def merge_shards(shards_path, final=True):
+    """Merge every shard's samples, metadata and images into dataset/, returning the cities touched
+
+    Merging is idempotent, so a partial merge can be repeated; only a final merge marks shards as done.
+    """
+    os.makedirs(os.path.join("dataset", "splits"), exist_ok=True)
+    merged_cities = set()
+
+    for shard in sorted(os.listdir(shards_path)):
+        shard_path = os.path.join(shards_path, shard)
+        shard_splits_path = os.path.join(shard_path, "dataset", "splits")
+        if os.path.exists(os.path.join(shard_path, "merged")) or not os.path.isdir(shard_splits_path):
+            continue
+
+        for city in sorted(os.listdir(shard_splits_path)):
+            city_splits_path = os.path.join("dataset", "splits", city)
+            os.makedirs(city_splits_path, exist_ok=True)
+            for folder in ("aerial", "ground"):
+                os.makedirs(os.path.join("dataset", city, folder), exist_ok=True)
+
+            # Images first, so samples.csv never references a file that hasn't been moved yet
+            for folder in ("aerial", "ground"):
+                source_path = os.path.join(shard_path, "dataset", city, folder)
+                if not os.path.isdir(source_path):
+                    continue
+                for name in os.listdir(source_path):
+                    target = os.path.join("dataset", city, folder, name)
+                    # Neighbouring samples share ground-level images, so the same file can be in several shards
+                    if os.path.exists(target):
+                        os.remove(os.path.join(source_path, name))
+                    else:
+                        shutil.move(os.path.join(source_path, name), target)
+
+            samples_path = os.path.join(city_splits_path, "samples.csv")
+            seen = {row[0] for row in manifest.read_rows(samples_path)}
+            with open(samples_path, "a") as f:
+                for row in manifest.read_rows(os.path.join(shard_splits_path, city, "samples.csv")):
+                    if row[0] not in seen:
+                        seen.add(row[0])
+                        f.write(",".join(row) + "\n")
+
+            shard_metadata_path = os.path.join(shard_splits_path, city, "ground_metadata.csv")
+            if os.path.exists(shard_metadata_path):
+                metadata_path = os.path.join(city_splits_path, "ground_metadata.csv")
+                has_header = os.path.exists(metadata_path)
+                with open(shard_metadata_path, "r", newline="") as f_in, open(metadata_path, "a", newline="") as f_out:
+                    reader = csv.reader(f_in)
+                    header = next(reader, None)
+                    writer = csv.writer(f_out)
+                    if header and not has_header:
+                        writer.writerow(header)
+                    writer.writerows(reader)
+
+            merged_cities.add(city)
+
+        if final:
+            open(os.path.join(shard_path, "merged"), "w").close()
+
+    for city in merged_cities:
+        dedupe_metadata(os.path.join("dataset", "splits", city, "ground_metadata.csv"))
+    return sorted(merged_cities)
+
+def main():
+    """Coordinate dataset collection across machines through leased work units in a shared SQLite store."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store", default=STORE_PATH, help="Shared coordination store")
+    parser.add_argument("--shards", default=SHARDS_PATH, help="Directory holding each node's shard")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Split cities into work units")
+    plan_parser.add_argument("cities", nargs="*", help="Cities to collect (default: all)")
+    plan_parser.add_argument("--samples", type=int, default=SAMPLES, help="Samples per city")
+    plan_parser.add_argument("--units", type=int, default=UNITS_SIDE, help="Work units per side of each city")
+    plan_parser.add_argument(
+        "--budget", type=int, default=CANDIDATES_PER_SAMPLE,
+        help="Candidates a unit may draw per sample of its quota before giving up",
+    )
+
+    node_parser = subparsers.add_parser("node", help="Collect leased units into this node's shard")
+    node_parser.add_argument("--node", default=socket.gethostname(), help="Unique name of this node")
+    node_parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="Lease length in seconds")
+    node_parser.add_argument("--heartbeat", type=float, default=HEARTBEAT_SECONDS, help="Seconds between lease renewals")
+
+    subparsers.add_parser("status", help="Show collection progress")
+
+    merge_parser = subparsers.add_parser("merge", help="Merge finished shards into dataset/")
+    merge_parser.add_argument("--force", action="store_true", help="Merge even though units are unfinished")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        unknown = [city for city in args.cities if city not in cities]
+        if unknown:
+            parser.error(f"Unknown cities: {', '.join(unknown)}")
+        conn = connect(args.store)
+        plan_units(conn, {city: cities[city] for city in args.cities or cities}, args.samples, args.units, args.budget)
+        (units,) = conn.execute("SELECT COUNT(*) FROM units").fetchone()
+        print(f"{units} work units planned in {args.store}")
+        conn.close()
+
+    elif args.command == "node":
+        if args.heartbeat >= args.lease:
+            parser.error("--heartbeat must be shorter than --lease")
+        run_node(args.store, args.shards, args.node, args.lease, args.heartbeat)
+
+    elif args.command == "status":
+        conn = connect(args.store)
+        for city, units, done, quota, collected, unplaced in unit_progress(conn):
+            print(f"{city}: {done}/{units} units, {collected}/{quota} samples" + (f", {unplaced} could not be placed" if unplaced else ""))
+        now = time.time()
+        for row in conn.execute("SELECT node, last_seen FROM nodes ORDER BY node"):
+            print(f"Node {row['node']}: last seen {now - row['last_seen']:.0f}s ago")
+        conn.close()
+
+    elif args.command == "merge":
+        conn = connect(args.store)
+        (unfinished,) = conn.execute("SELECT COUNT(*) FROM units WHERE done = 0").fetchone()
+        conn.close()
+        if unfinished and not args.force:
+            parser.error(f"{unfinished} units are unfinished; wait for the nodes or pass --force")
+
+        merged_cities = merge_shards(args.shards, final=not unfinished)
+        if os.path.exists(manifest.MANIFEST_PATH):
+            conn = manifest.connect()
+            for city in merged_cities:
+                manifest.migrate_city(conn, city)
+        else:
+            # A new manifest has to hold every city in dataset/, not only the merged ones
+            conn = manifest.connect_complete()
+        conn.close()
+        print(f"Merged {len(merged_cities)} cities into dataset/")
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,53 @@ import multiprocessing as mp
 import os
 import random
 import shutil
+import sqlite3
+import tempfile
 import threading
 import time
-from io import BytesIO
 
 import numpy as np
 import requests
-from PIL import Image
 from typing import Optional
 from tqdm import tqdm
 
+import manifest
+
+# Bytes read from the network per write, so a download never holds a whole image in memory
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+# Set number of samples per city
+SAMPLES = 100
+
+# Mapillary API token
+MLY_KEY = "MLY|9042214512506386|3607fa048afce1dfb774b938cbf843f9"
+
+# In meters
+R_EARTH = 6378000
+
+# Side length of desired aerial image in meters (~100-125 is zoom level 18)
+SIDE_LENGTH = 125
+
+# Minimum distance in meters between sample centres (25m keeps aerial overlap under ~80%), 0 to disable
+MIN_SEPARATION = 25
+
+# How candidate sample centres are drawn: "uniform" or "halton"
+CANDIDATES = "halton"
+
+# Set the min and max number of ground-level images per sample
+GL_SAMPLES_MIN = 1
+GL_SAMPLES_MAX = 25
+
+# Frames of one sequence are redundant when they are this close to a kept frame on every axis (None ignores an axis,
+# and with every axis None no frame is dropped)
+FRAME_SPACING = {"seconds": 60, "meters": 10, "degrees": 30}
+
+# Ground-level metadata requested per sample, as a multiple of the images kept, so thinning has frames to choose from
+GL_OVERFETCH = 4
+
+# Worker processes per collector
+NUM_PROCESSES = 12
+
 
 def task(
     city,
@@ -25,9 +62,107 @@ def task(
     MLY_KEY,
     R_EARTH,
     SIDE_LENGTH,
+    MIN_SEPARATION,
+    CANDIDATES,
 ):
-    latitude, longitude = random.uniform(south, north), random.uniform(east, west)
+    latitude, longitude = next_candidate(city, west, south, east, north, CANDIDATES)
+
+    # Reject points too close to an accepted sample before spending any API calls on them
+    cell = reserve_location(latitude, longitude, (south + north) / 2, R_EARTH, MIN_SEPARATION)
+    if cell is None:
+        return False
+
+    if collect_sample(
+        city, latitude, longitude, samples_path, metadata_path, MLY_KEY, R_EARTH, SIDE_LENGTH,
+    ):
+        return True
+
+    release_location(cell, latitude, longitude)
+    return False
+
+
+def next_candidate(city, west, south, east, north, method="uniform"):
+    """Draw the next candidate sample centre, uniformly or from a Halton sequence shared by all workers"""
+    # The index also counts candidates drawn, whichever method draws them
+    with lock:
+        candidate_index.value += 1
+        index = candidate_index.value
+
+    if method == "halton":
+        # A fixed per-city shift keeps the sequence's even spread without always starting at the corner
+        rng = random.Random(city)
+        u = (halton(index, 2) + rng.random()) % 1
+        v = (halton(index, 3) + rng.random()) % 1
+        return south + v * (north - south), west + u * (east - west)
+
+    return random.uniform(south, north), random.uniform(east, west)
+
+
+def halton(index, base):
+    """The index-th element of the van der Corput sequence in the given base"""
+    result = 0.0
+    fraction = 1.0
+    while index > 0:
+        fraction /= base
+        result += fraction * (index % base)
+        index //= base
+    return result
+
+
+def location_cell(latitude, longitude, mid_latitude, R_EARTH, MIN_SEPARATION):
+    """Spatial hash cell, MIN_SEPARATION meters on a side, containing a point"""
+    cell_degrees = (MIN_SEPARATION / R_EARTH) * (180 / np.pi)
+    return (
+        int(np.floor(latitude / cell_degrees)),
+        int(np.floor(longitude * np.cos(mid_latitude * (np.pi / 180)) / cell_degrees)),
+    )
+
+
+def reserve_location(latitude, longitude, mid_latitude, R_EARTH, MIN_SEPARATION):
+    """Claim a sample centre unless an accepted one lies within MIN_SEPARATION meters, returning its cell"""
+    if not MIN_SEPARATION:
+        return ()
+
+    cell = location_cell(latitude, longitude, mid_latitude, R_EARTH, MIN_SEPARATION)
+    lng_scale = np.cos(mid_latitude * (np.pi / 180))
+    meters_per_degree = R_EARTH * (np.pi / 180)
 
+    with lock:
+        for i in range(cell[0] - 1, cell[0] + 2):
+            for j in range(cell[1] - 1, cell[1] + 2):
+                for other_latitude, other_longitude in accepted_locations.get((i, j), []):
+                    distance = meters_per_degree * np.hypot(
+                        latitude - other_latitude, (longitude - other_longitude) * lng_scale
+                    )
+                    if distance < MIN_SEPARATION:
+                        return None
+
+        # Manager dict values are copies, so the list has to be reassigned
+        accepted_locations[cell] = accepted_locations.get(cell, []) + [(latitude, longitude)]
+    return cell
+
+
+def release_location(cell, latitude, longitude):
+    """Give up a reserved sample centre after the sample failed"""
+    if not cell:
+        return
+    with lock:
+        locations = accepted_locations.get(cell, [])
+        if (latitude, longitude) in locations:
+            locations.remove((latitude, longitude))
+            accepted_locations[cell] = locations
+
+
+def collect_sample(
+    city,
+    latitude,
+    longitude,
+    samples_path,
+    metadata_path,
+    MLY_KEY,
+    R_EARTH,
+    SIDE_LENGTH,
+):
     lat_delta = (SIDE_LENGTH / R_EARTH) * (180 / np.pi) / 2
     lng_delta = (SIDE_LENGTH / R_EARTH) * (180 / np.pi) / np.cos(latitude * (np.pi / 180)) / 2
     
@@ -67,14 +202,11 @@ def task(
         "camera_parameters",
     ]
 
-    # Set the min and max number of ground-level images per sample
-    GL_SAMPLES_MIN = 1
-    GL_SAMPLES_MAX = 25
     gl_params = {
         "access_token": MLY_KEY,
         "bbox": ",".join(map(str, gl_bbox)),
         "is_pano": False,
-        "limit": GL_SAMPLES_MAX,
+        "limit": GL_SAMPLES_MAX * GL_OVERFETCH,
         "fields": ",".join(gl_fields),
     }
 
@@ -85,7 +217,7 @@ def task(
         "bboxsr": 4326,
         "size": ",".join(map(str, [512, 512])),
         "adjustAspectRatio": False,
-        "format": "png32",
+        "format": "png24",
         "interpolation": "RSP_NearestNeighbor",
         "f": "image",
     }
@@ -99,6 +231,8 @@ def task(
             for gl_data in gl_data_dict["data"]
             if all(field in gl_data for field in gl_fields)
         ]
+        # Drop near-identical frames before any thumbnail is fetched
+        gl_data_dict["data"] = thin_frames(gl_data_dict["data"], FRAME_SPACING, GL_SAMPLES_MAX, R_EARTH)
         if len(gl_data_dict["data"]) < GL_SAMPLES_MIN:
             # print("Response didn't return enough ground-level images for the sample")
             return False
@@ -112,6 +246,13 @@ def task(
         # print("Ground-level samples request returned empty")
         return False
 
+    aer_output_path = os.path.join(
+        "dataset",
+        city,
+        "aerial",
+        f"aerial_{aer_bbox[0]}_{aer_bbox[1]}_{aer_bbox[2]}_{aer_bbox[3]}.png",
+    )
+
     aer_image = []
     aer_thread = threading.Thread(
         target=make_request,
@@ -119,6 +260,7 @@ def task(
             "stop_event": stop_event,
             "url": aer_data_url,
             "save_to": aer_image,
+            "save_path": aer_output_path,
             "params": aer_params,
         },
     )
@@ -155,6 +297,7 @@ def task(
                     "stop_event": stop_event,
                     "url": gl_data["thumb_original_url"],
                     "save_to": gl_data_map[gl_data["id"]],
+                    "save_path": os.path.join("dataset", city, "ground", f"{gl_data['id']}.jpg"),
                 },
             )
         )
@@ -167,21 +310,14 @@ def task(
 
     if not aer_image:
         # print("make_request didn't return an aerial image")
+        # Abort in-flight ground-level downloads and discard any this task staged
         stop_event.set()
-        return False
-    
-    aer_image = aer_image[0]
-
-    aer_output_path = os.path.join(
-        "dataset",
-        city,
-        "aerial",
-        f"aerial_{aer_bbox[0]}_{aer_bbox[1]}_{aer_bbox[2]}_{aer_bbox[3]}.png",
-    )
-    try:
-        aer_image.convert("RGB").save(aer_output_path, "PNG")
-    except Exception as e:
-        stop_event.set()
+        for t in threads:
+            t.join()
+        remove_files(
+            gl_image[0] for gl_id, gl_image in gl_data_map.items()
+            if gl_image and gl_image[0] != os.path.join("dataset", city, "ground", f"{gl_id}.jpg")
+        )
         return False
 
     row = []
@@ -192,34 +328,38 @@ def task(
 
     for gl_id, gl_image in gl_data_map.items():
         if gl_image:
-            gl_image = gl_image[0]
-        else:
-            continue
+            row.append(f"{gl_id}.jpg")
 
-        gl_output_path = os.path.join("dataset", city, "ground", f"{gl_id}.jpg")
-        
-        try:
-            gl_image.convert("RGB").save(gl_output_path, "JPEG")
-        except Exception as e:
-            # print(f"GL image bytes could not be saved into jpeg with error: {e}")
-            continue
-        
-        row.append(f"{gl_id}.jpg")
+    staged = [(aer_image[0], aer_output_path)] + [
+        (gl_image[0], os.path.join("dataset", city, "ground", f"{gl_id}.jpg"))
+        for gl_id, gl_image in gl_data_map.items() if gl_image
+    ]
 
     if len(row) < 1 + GL_SAMPLES_MIN:
-        files_to_remove = [aer_output_path] + [
-            os.path.join("dataset", city, "ground", f"{gl_id}.jpg") 
-            for gl_id in row[1:]
-        ]
-        for file_path in files_to_remove:
-            try:
-                os.remove(file_path)
-            except FileNotFoundError:
-                pass
+        # Only this task's staged files go; images other samples already published are left alone
+        remove_files(staged_path for staged_path, save_path in staged if staged_path != save_path)
         # print(f"Sample failed to meet minimum threshold of {GL_SAMPLES_MIN} ground-level image(s)")
         return False
 
     with lock:
+        for staged_path, save_path in staged:
+            publish(staged_path, save_path)
+
+        # The manifest goes first: once a city is marked complete, reconcile_dataset.py deletes the images of
+        # any sample it lacks, so a sample it failed to take must either stay out of the CSVs too or unmark the city
+        try:
+            with manifest_conn:
+                manifest.add_ground_images(manifest_conn, city, gl_data_dict["data"])
+                manifest.add_sample(manifest_conn, city, row[0], row[1:])
+        except sqlite3.Error as e:
+            try:
+                with manifest_conn:
+                    manifest.mark_incomplete(manifest_conn, city)
+            except sqlite3.Error:
+                print(f"Dropped sample {row[0]}: the manifest couldn't record it ({e})")
+                return False
+            print(f"The manifest couldn't record {row[0]} ({e}); {city} falls back to its CSVs until it is migrated again")
+
         with open(samples_path, "a", newline="") as file:
             writer = csv.writer(file)
             writer.writerow(row)
@@ -237,10 +377,64 @@ def task(
         return True # Indicate success
 
 
+def thin_frames(gl_data_list, spacing, limit, R_EARTH):
+    """Keep up to `limit` frames, dropping any that sit within `spacing` of a kept frame from the same sequence
+
+    Frames are considered in capture order per sequence, and the kept frames are interleaved across sequences
+    so a single long sequence can't use up the whole limit.
+    """
+    sequences = {}
+    for gl_data in sorted(gl_data_list, key=lambda gl_data: gl_data["captured_at"] or 0):
+        sequences.setdefault(gl_data["sequence"], []).append(gl_data)
+
+    meters_per_degree = R_EARTH * (np.pi / 180)
+    # With no axis to compare on, nothing shows a frame is redundant
+    thinning = any(spacing.get(axis) is not None for axis in ("seconds", "meters", "degrees"))
+
+    def is_close(a, b):
+        if not thinning:
+            return False
+        # Missing values can't show a frame is redundant, so they count as far apart
+        if spacing.get("seconds") is not None:
+            if a["captured_at"] is None or b["captured_at"] is None:
+                return False
+            if abs(a["captured_at"] - b["captured_at"]) >= spacing["seconds"] * 1000:
+                return False
+        if spacing.get("meters") is not None:
+            if not a["computed_geometry"] or not b["computed_geometry"]:
+                return False
+            a_lng, a_lat = a["computed_geometry"]["coordinates"]
+            b_lng, b_lat = b["computed_geometry"]["coordinates"]
+            distance = meters_per_degree * np.hypot(a_lat - b_lat, (a_lng - b_lng) * np.cos(a_lat * (np.pi / 180)))
+            if distance >= spacing["meters"]:
+                return False
+        if spacing.get("degrees") is not None:
+            if a["computed_compass_angle"] is None or b["computed_compass_angle"] is None:
+                return False
+            difference = abs(a["computed_compass_angle"] - b["computed_compass_angle"]) % 360
+            if min(difference, 360 - difference) >= spacing["degrees"]:
+                return False
+        return True
+
+    kept_sequences = []
+    for frames in sequences.values():
+        kept = []
+        for gl_data in frames:
+            if not any(is_close(gl_data, other) for other in kept):
+                kept.append(gl_data)
+        kept_sequences.append(kept)
+
+    thinned = []
+    for i in range(max((len(kept) for kept in kept_sequences), default=0)):
+        thinned.extend(kept[i] for kept in kept_sequences if i < len(kept))
+    return thinned[:limit]
+
+
 def make_request(
     stop_event,
     url: str,
     save_to: Optional[list] = None,
+    save_path: Optional[str] = None,
     params: Optional[dict] = None,
     retries: int = 4,
     delay: int = 1,
@@ -249,11 +443,17 @@ def make_request(
         if stop_event.is_set():
             return
         try:
-            response = requests.get(url, params=params, timeout=6)
-            if save_to is None:
+            if save_path is None:
+                response = requests.get(url, params=params, timeout=6)
                 return response.json()
+            elif os.path.exists(save_path):
+                # Neighbouring samples share ground-level images, so an earlier sample may have published it
+                save_to.append(save_path)
+                return
             else:
-                save_to.append(Image.open(BytesIO(response.content)))
+                staged_path = download(stop_event, url, save_path, params)
+                if staged_path:
+                    save_to.append(staged_path)
                 return
         except Exception as e:
             # print(f"Attempt {attempt + 1} failed: {e}")
@@ -261,11 +461,146 @@ def make_request(
     return
 
 
-def init_worker(shared_lock, shared_num_lines):
+def download(stop_event, url: str, save_path: str, params: Optional[dict] = None):
+    """Stream an image response in chunks to a temp file next to save_path, returning its path once complete
+
+    The temp name is unique to this download, so tasks fetching the same image never touch each other's
+    files; publish() moves it into place once the sample is accepted.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(save_path), prefix=f"{os.path.basename(save_path)}.", suffix=".part")
+    complete = False
+    try:
+        with os.fdopen(fd, "wb") as file, requests.get(url, params=params, timeout=6, stream=True) as response:
+            response.raise_for_status()
+            # Error bodies come back as JSON or HTML, so only accept images
+            if not response.headers.get("Content-Type", "").startswith("image/"):
+                raise ValueError(f"Expected an image, got {response.headers.get('Content-Type')}")
+
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if stop_event.is_set():
+                    return None
+                file.write(chunk)
+        complete = True
+        return tmp_path
+    finally:
+        if not complete:
+            remove_files([tmp_path])
+
+
+def publish(staged_path, save_path):
+    """Move a staged download into place, keeping the existing file if another sample published it first"""
+    if staged_path == save_path:
+        return
+    if os.path.exists(save_path):
+        os.remove(staged_path)
+    else:
+        os.replace(staged_path, save_path)
+
+
+def remove_files(file_paths):
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+def collect_samples(
+    city, bbox, target, manager, num_lines, pbar=None, candidate_start=0, accepted=(), keep_going=None,
+):
+    """Run the worker pool over a bbox until `target` samples succeed, returning the samples and candidates used
+
+    `accepted` seeds the spatial hash with (latitude, longitude) centres collected earlier, and `keep_going`
+    is polled with the progress so far; once it returns False no new tasks are submitted.
+    """
+    west, south, east, north = bbox
+    os.makedirs(os.path.join("dataset", city), exist_ok=True)
+    os.makedirs(os.path.join("dataset", city, "aerial"), exist_ok=True)
+    os.makedirs(os.path.join("dataset", city, "ground"), exist_ok=True)
+    os.makedirs(os.path.join("dataset", "splits", city), exist_ok=True)
+
+    samples_path = os.path.join("dataset", "splits", city, "samples.csv")
+    metadata_path = os.path.join("dataset", "splits", city, "ground_metadata.csv")
+
+    # A city collected from scratch is recorded in the manifest as it goes, so the manifest holds all of it
+    if not os.path.exists(samples_path):
+        conn = manifest.connect()
+        with conn:
+            manifest.add_city(conn, city)
+        conn.close()
+
+    lock = mp.Lock()
+    accepted_locations = manager.dict()
+    candidate_index = mp.Value("i", candidate_start)
+
+    if MIN_SEPARATION:
+        seeded = {}
+        for latitude, longitude in accepted:
+            cell = location_cell(latitude, longitude, (south + north) / 2, R_EARTH, MIN_SEPARATION)
+            seeded.setdefault(cell, []).append((latitude, longitude))
+        accepted_locations.update(seeded)
+
+    successful_samples = 0
+    active_tasks = []
+    stopping = False
+
+    with mp.Pool(processes=NUM_PROCESSES, initializer=init_worker, initargs=(lock, num_lines, accepted_locations, candidate_index)) as pool:
+        while active_tasks or (successful_samples < target and not stopping):
+            if keep_going is not None and not stopping:
+                stopping = not keep_going(successful_samples, candidate_index.value)
+
+            # Submit new tasks if we have room
+            while not stopping and len(active_tasks) < NUM_PROCESSES + 2 and successful_samples + len(active_tasks) < target:
+                task_args = (
+                    city, west, south, east, north, samples_path, metadata_path,
+                    MLY_KEY, R_EARTH, SIDE_LENGTH, MIN_SEPARATION, CANDIDATES,
+                )
+                async_result = pool.apply_async(task, task_args)
+                active_tasks.append(async_result)
+
+            # Check for completed tasks
+            completed_tasks = []
+            for async_result in active_tasks:
+                if async_result.ready():
+                    result = async_result.get()
+                    if result is True:
+                        successful_samples += 1
+                        if pbar is not None:
+                            pbar.update(1)  # Update overall progress
+                    completed_tasks.append(async_result)
+
+            # Remove completed tasks
+            for completed in completed_tasks:
+                active_tasks.remove(completed)
+
+    return successful_samples, candidate_index.value
+
+
+def dedupe_metadata(metadata_path):
+    """Remove duplicate metadata rows"""
+    if os.path.exists(metadata_path):
+        with open(metadata_path, mode="r+", newline="") as file:
+            reader = list(csv.reader(file))
+            saved = set(tuple(row) for row in reader[1:])
+            file.seek(0)
+
+            writer = csv.writer(file)
+            writer.writerow(reader[0])
+            writer.writerows(saved)
+            file.truncate()
+
+
+def init_worker(shared_lock, shared_num_lines, shared_accepted_locations, shared_candidate_index):
     global lock
     global num_lines
+    global manifest_conn
+    global accepted_locations
+    global candidate_index
     lock = shared_lock
     num_lines = shared_num_lines
+    accepted_locations = shared_accepted_locations
+    candidate_index = shared_candidate_index
+    manifest_conn = manifest.connect()
 
 
 if __name__ == "__main__":
@@ -305,81 +640,20 @@ if __name__ == "__main__":
         shutil.rmtree("dataset")
     os.makedirs("dataset", exist_ok=True)
     os.makedirs(os.path.join("dataset", "splits"), exist_ok=True)
+    manifest.connect().close()
 
-    # Set number of samples per city
-    SAMPLES = 100
-
-    # Mapillary API token
-    MLY_KEY = "MLY|9042214512506386|3607fa048afce1dfb774b938cbf843f9"
-
-    # In meters
-    R_EARTH = 6378000
-
-    # Side length of desired aerial image in meters (~100-125 is zoom level 18)
-    SIDE_LENGTH = 125
+    manager = mp.Manager()
 
     num_lines = mp.Value("i", 0)
 
     total_target_samples = len(cities) * SAMPLES
-    total_successful_samples = 0
 
     with tqdm(total=total_target_samples, desc="Dataset progress", unit="successful samples") as pbar:
         for city, bbox in cities.items():
             tqdm.write(f"Processing {city}...")
 
-            west, south, east, north = bbox
-            os.makedirs(os.path.join("dataset", city), exist_ok=True)
-            os.makedirs(os.path.join("dataset", city, "aerial"), exist_ok=True)
-            os.makedirs(os.path.join("dataset", city, "ground"), exist_ok=True)
-            os.makedirs(os.path.join("dataset", "splits", city), exist_ok=True)
-
-            samples_path = os.path.join("dataset", "splits", city, "samples.csv")
-            metadata_path = os.path.join("dataset", "splits", city, "ground_metadata.csv")
-
-            lock = mp.Lock()
-
-            successful_samples = 0
-            active_tasks = []
-
-            NUM_PROCESSES = 12
-            
-            with mp.Pool(processes=NUM_PROCESSES, initializer=init_worker, initargs=(lock, num_lines)) as pool:
-                while successful_samples < SAMPLES:
-                    # Submit new tasks if we have room
-                    while len(active_tasks) < NUM_PROCESSES + 2 and successful_samples + len(active_tasks) < SAMPLES:
-                        task_args = (
-                            city, west, south, east, north, samples_path, metadata_path,
-                            MLY_KEY, R_EARTH, SIDE_LENGTH,
-                        )
-                        async_result = pool.apply_async(task, task_args)
-                        active_tasks.append(async_result)
-                    
-                    # Check for completed tasks
-                    completed_tasks = []
-                    for async_result in active_tasks:
-                        if async_result.ready():
-                            result = async_result.get()
-                            if result is True:
-                                successful_samples += 1
-                                total_successful_samples += 1
-                                pbar.update(1)  # Update overall progress
-                            completed_tasks.append(async_result)
-                    
-                    # Remove completed tasks
-                    for completed in completed_tasks:
-                        active_tasks.remove(completed)
-                    
-            # Remove duplicate metadata rows
-            if os.path.exists(metadata_path):
-                with open(metadata_path, mode="r+", newline="") as file:
-                    reader = list(csv.reader(file))
-                    saved = set(tuple(row) for row in reader[1:])
-                    file.seek(0)
-                    
-                    writer = csv.writer(file)
-                    writer.writerow(reader[0])
-                    writer.writerows(saved)
-                    file.truncate()
+            collect_samples(city, bbox, SAMPLES, manager, num_lines, pbar)
+            dedupe_metadata(os.path.join("dataset", "splits", city, "ground_metadata.csv"))
 
             tqdm.write(f"Completed {city}!")
-    print("Dataset complete!")
\ No newline at end of file
+    print("Dataset complete!")
@@ -1,12 +1,14 @@
+import json
 import os
-import random
 import folium
-import pandas as pd
 from folium.plugins import HeatMap
-import geopandas as gpd
-from shapely.geometry import box
 import numpy as np
 
+from grid_overlay import add_grid_overlay, hex_to_rgba
+import manifest
+from rebalance_dataset import finish_rebalance
+from sample_cache import cached_sample_bboxes
+
 cities = {
     # Dense ground mapillary data
     "Colorado Springs": [-104.985348, 38.6739578, -104.665348, 38.9939578],  # 30cm/px
@@ -44,165 +46,367 @@ TEST_SPLIT = 0.1
 
 N_REGIONS_SIDE = 20
 
-regions = [(i, j) for i in range(N_REGIONS_SIDE) for j in range(N_REGIONS_SIDE)]
-random.shuffle(regions)
-train = set(regions[:int(len(regions) * TRAIN_SPLIT)])
-val = set(regions[int(len(regions) * TRAIN_SPLIT):-int(len(regions) * TEST_SPLIT)])
-test = set(regions[-int(len(regions) * TEST_SPLIT):])
-
-heat_data = set()
-
-for city in os.listdir(os.path.join("dataset", "splits")):
-    city_splits_path = os.path.join("dataset", "splits", city)
-
-    if not os.path.exists(os.path.join(city_splits_path, "comp_samples.csv")):
-        lost_count = 0
-        total_count = 0
-
-        lost_samples = 0
-        total_samples = 0
-
-        with (
-            open(os.path.join(city_splits_path, "samples.csv"), "r") as f_samples,
-            open(os.path.join(city_splits_path, "comp_samples.csv"), "w") as f_comp_samples, 
-        ):
-            df = pd.read_csv(os.path.join(city_splits_path, "ground_metadata.csv"))
-            for line in f_samples:
-                line_list = line[:-1].split(",")
-
-                bbox = line_list[0][:-4].split("_")[1:]
-                bbox = [float(value) for value in bbox]
-                lat_diff = bbox[2] - bbox[0]
-                lng_diff = bbox[3] - bbox[1]
-                bbox = [
-                    bbox[0] + (lng_diff / 4),
-                    bbox[1] + (lat_diff / 4),
-                    bbox[2] - (lng_diff / 4),
-                    bbox[3] - (lat_diff / 4),
-                ]
-                new_line_list = []
-                for gl in line_list[1:]:
-                    id_num = int(gl[:-4])
-                    lat = df.loc[df["id"] == id_num, "computed_latitude"].values[0]
-                    lng = df.loc[df["id"] == id_num, "computed_longitude"].values[0]
-
-                    if bbox[0] < lng < bbox[2] and bbox[1] < lat < bbox[3]:
-                        new_line_list.append(gl)
-                    else:
-                        lost_count += 1
-                    total_count += 1
-                total_samples += 1
+# Seed for the region shuffle, persisted per city alongside its splits
+SEED = 0
+
+# Approximate bytes of CSV lines held in memory at once
+CHUNK_BYTES = 1 << 24
+
+TRAIN, VAL, TEST, UNUSED = 0, 1, 2, -1
+SPLIT_NAMES = {TRAIN: "train", VAL: "validation", TEST: "test"}
+SPLIT_FILES = {split: manifest.SPLIT_FILES[name] for split, name in SPLIT_NAMES.items()}
+SPLIT_COLORS = {
+    TRAIN: hex_to_rgba('#0000FF', 0.6),  # blue
+    VAL: hex_to_rgba('#FFA500', 0.6),  # orange
+    TEST: hex_to_rgba('#00FF00', 0.6),  # green
+    UNUSED: hex_to_rgba('#FFFFFF', 0.6),  # white
+}
+
+def load_gl_coordinates(metadata_path):
+    """Load ground-level coordinates into id-sorted arrays for searchsorted lookups"""
+    ids, coordinates = manifest.read_ground_fields(metadata_path, ["computed_latitude", "computed_longitude"])
+    return ids, coordinates[:, 0], coordinates[:, 1]
+
+def comp_filter(rows, gl_ids, gl_lats, gl_lngs):
+    """Flag ground-level images whose computed location falls in the centre quarter of their sample's aerial bbox"""
+    counts = np.array([len(row) - 1 for row in rows], dtype=np.int64)
+    bboxes = np.array([manifest.parse_bbox(row[0]) for row in rows], dtype=np.float64).reshape(-1, 4)
+    ids = np.array([int(gl[:-4]) for row in rows for gl in row[1:]], dtype=np.int64)
+
+    if len(gl_ids) == 0 or len(ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+
+    # Every ground-level image gets its sample's aerial bbox
+    bboxes = np.repeat(bboxes, counts, axis=0)
+    lng_diff = (bboxes[:, 2] - bboxes[:, 0]) / 4
+    lat_diff = (bboxes[:, 3] - bboxes[:, 1]) / 4
+
+    pos = np.minimum(np.searchsorted(gl_ids, ids), len(gl_ids) - 1)
+    found = gl_ids[pos] == ids
+    lat = gl_lats[pos]
+    lng = gl_lngs[pos]
+
+    return (
+        found
+        & (bboxes[:, 0] + lng_diff < lng) & (lng < bboxes[:, 2] - lng_diff)
+        & (bboxes[:, 1] + lat_diff < lat) & (lat < bboxes[:, 3] - lat_diff)
+    )
+
+def read_chunks(path, offset=0):
+    """Yield complete lines in bounded chunks, along with the byte offset just past each chunk"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            lines = f.readlines(CHUNK_BYTES)
+            if not lines:
+                return
+            offset = f.tell()
+
+            # Leave a partially written last line for the next run
+            if not lines[-1].endswith(b"\n"):
+                offset -= len(lines.pop())
+                if lines:
+                    yield [line.decode() for line in lines], offset
+                return
+
+            yield [line.decode() for line in lines], offset
+
+def parse_bboxes(lines):
+    """Parse the aerial bbox encoded in each sample's aerial filename into an (n, 4) array"""
+    return np.array(
+        [manifest.parse_bbox(line.split(",", 1)[0].strip()) for line in lines],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+
+def fill_region_labels(labels, rng):
+    """Label every UNUSED region, bringing the split proportions as close to TRAIN_SPLIT/TEST_SPLIT as the labelled ones allow"""
+    flat = labels.reshape(-1)
+    n_train = max(int(flat.size * TRAIN_SPLIT) - int(np.count_nonzero(flat == TRAIN)), 0)
+    n_test = max(int(flat.size * TEST_SPLIT) - int(np.count_nonzero(flat == TEST)), 0)
+
+    order = rng.permutation(np.flatnonzero(flat == UNUSED))
+    n_train = min(n_train, len(order))
+    n_test = min(n_test, len(order) - n_train)
+    flat[order] = VAL
+    flat[order[:n_train]] = TRAIN
+    flat[order[len(order) - n_test:]] = TEST
+    return labels
+
+def region_corners(bboxes, city_bounds, n_side):
+    """Region indices (left, bottom, right, top) of each sample's ground-level bbox corners, clipped to the grid,
+    and whether all four fell inside it"""
+    long_unit = (city_bounds[2] - city_bounds[0]) / n_side
+    lat_unit = (city_bounds[3] - city_bounds[1]) / n_side
+
+    long_gl_diff = (bboxes[:, 2] - bboxes[:, 0]) / 4
+    lat_gl_diff = (bboxes[:, 3] - bboxes[:, 1]) / 4
+
+    # Truncate toward zero like int() so edge samples land in the same regions as before
+    left = ((bboxes[:, 0] + long_gl_diff - city_bounds[0]) / long_unit).astype(np.int64)
+    bottom = ((bboxes[:, 1] + lat_gl_diff - city_bounds[1]) / lat_unit).astype(np.int64)
+    right = ((bboxes[:, 2] - long_gl_diff - city_bounds[0]) / long_unit).astype(np.int64)
+    top = ((bboxes[:, 3] - lat_gl_diff - city_bounds[1]) / lat_unit).astype(np.int64)
+
+    inside = (left >= 0) & (bottom >= 0) & (right < n_side) & (top < n_side)
+    left, bottom, right, top = (np.clip(edge, 0, n_side - 1) for edge in (left, bottom, right, top))
+    return left, bottom, right, top, inside
+
+def infer_region_labels(city, city_splits_path):
+    """Recover the region map behind split files written before it was persisted, or None if the files disagree
+
+    Those files came from an unseeded shuffle, so every region one of their samples touches keeps that sample's
+    split; regions none of them touch get seeded labels.
+    """
+    labels = np.full((N_REGIONS_SIDE, N_REGIONS_SIDE), UNUSED, dtype=np.int8)
+    for split, file_name in SPLIT_FILES.items():
+        split_path = os.path.join(city_splits_path, file_name)
+        if not os.path.exists(split_path):
+            continue
+        for lines, _ in read_chunks(split_path):
+            lines = [line for line in lines if line.strip()]
+            left, bottom, right, top, inside = region_corners(parse_bboxes(lines), cities[city], N_REGIONS_SIDE)
+            # All four corners of every sample in this split's file
+            rows = np.concatenate([left, left, right, right])[np.tile(inside, 4)]
+            columns = np.concatenate([top, bottom, top, bottom])[np.tile(inside, 4)]
+            if np.any((labels[rows, columns] != UNUSED) & (labels[rows, columns] != split)):
+                return None
+            labels[rows, columns] = split
+
+    return fill_region_labels(labels, np.random.default_rng(SEED))
+
+def load_region_labels(city, city_splits_path):
+    """Load a city's persisted region split assignment, creating one on first use
+
+    Raises ValueError if the city has split files from before the assignment was persisted that no single
+    region map explains.
+    """
+    regions_path = os.path.join(city_splits_path, "regions.json")
+    if os.path.exists(regions_path):
+        with open(regions_path, "r") as f:
+            return np.array(json.load(f)["labels"], dtype=np.int8)
+
+    # A fresh map would put new rows in different regions than the ones these files already use
+    if any(os.path.exists(os.path.join(city_splits_path, file_name)) for file_name in SPLIT_FILES.values()):
+        labels = infer_region_labels(city, city_splits_path)
+        if labels is None:
+            raise ValueError(f"{city}'s split files put samples from one region in different splits")
+    else:
+        labels = fill_region_labels(np.full((N_REGIONS_SIDE, N_REGIONS_SIDE), UNUSED, dtype=np.int8), np.random.default_rng(SEED))
+
+    with open(f"{regions_path}.tmp", "w") as f:
+        json.dump({"seed": SEED, "labels": labels.tolist()}, f)
+    os.replace(f"{regions_path}.tmp", regions_path)
+    return labels
+
+def reset_splits(city_splits_path):
+    """Remove a city's split files, their map and its split progress, so its comp samples are split again from scratch"""
+    for file_name in [*SPLIT_FILES.values(), "grid_cells.html", "split_state.json"]:
+        path = os.path.join(city_splits_path, file_name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def assign_splits(bboxes, city_bounds, labels):
+    """Assign each sample the split shared by all four corners of its ground-level bbox, or UNUSED"""
+    left, bottom, right, top, inside = region_corners(bboxes, city_bounds, labels.shape[0])
+    corner = labels[left, top]
+    same = (corner == labels[left, bottom]) & (corner == labels[right, top]) & (corner == labels[right, bottom])
+    return np.where(inside & same, corner, UNUSED)
+
+def load_state(city_splits_path):
+    """Load how far into samples.csv and comp_samples.csv a city has already been split
+
+    "sizes" holds the size of each output file when the offsets were saved, so a run that crashed between
+    appending rows and saving can be cut back before the rows are appended again.
+    """
+    state_path = os.path.join(city_splits_path, "split_state.json")
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            state = json.load(f)
+        state.setdefault("sizes", {})
+        return state
+
+    # Files split before the state was tracked are treated as fully processed
+    state = {"samples_offset": 0, "comp_samples_offset": 0, "sizes": {}}
+    comp_samples_path = os.path.join(city_splits_path, "comp_samples.csv")
+    if os.path.exists(comp_samples_path):
+        state["samples_offset"] = os.path.getsize(os.path.join(city_splits_path, "samples.csv"))
+        if os.path.exists(os.path.join(city_splits_path, "train.csv")):
+            state["comp_samples_offset"] = os.path.getsize(comp_samples_path)
+
+    # Saved straight away, or rows appended before the next run would count as split too
+    record_sizes(city_splits_path, state, [
+        file_name for file_name in ["comp_samples.csv", *SPLIT_FILES.values()]
+        if os.path.exists(os.path.join(city_splits_path, file_name))
+    ])
+    save_state(city_splits_path, state)
+    return state
+
+def save_state(city_splits_path, state):
+    """Write the state through a temp file, so a crash leaves either the old state or the new one"""
+    state_path = os.path.join(city_splits_path, "split_state.json")
+    with open(f"{state_path}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{state_path}.tmp", state_path)
+
+def truncate_outputs(city_splits_path, state, file_names):
+    """Cut output files back to their sizes in the state, dropping rows appended after it was last saved"""
+    for file_name in file_names:
+        path = os.path.join(city_splits_path, file_name)
+        size = state["sizes"].get(file_name)
+        if size is not None and os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+def record_sizes(city_splits_path, state, file_names):
+    for file_name in file_names:
+        state["sizes"][file_name] = os.path.getsize(os.path.join(city_splits_path, file_name))
+
+def filter_new_samples(city, city_splits_path, state, conn=None):
+    """Run the comp filter over samples.csv rows appended since the last run"""
+    samples_path = os.path.join(city_splits_path, "samples.csv")
+    if os.path.getsize(samples_path) <= state["samples_offset"]:
+        return
+
+    if conn is not None:
+        gl_ids, gl_lats, gl_lngs = manifest.ground_coordinates(conn, city)
+    else:
+        gl_ids, gl_lats, gl_lngs = load_gl_coordinates(os.path.join(city_splits_path, "ground_metadata.csv"))
+
+    lost_count = 0
+    total_count = 0
+
+    lost_samples = 0
+    total_samples = 0
+
+    truncate_outputs(city_splits_path, state, ["comp_samples.csv"])
+    with open(os.path.join(city_splits_path, "comp_samples.csv"), "a") as f_comp_samples:
+        for lines, offset in read_chunks(samples_path, state["samples_offset"]):
+            rows = [line.strip().split(",") for line in lines if line.strip()]
+            keep = comp_filter(rows, gl_ids, gl_lats, gl_lngs).tolist()
+
+            start = 0
+            for row in rows:
+                end = start + len(row) - 1
+                new_line_list = [gl for gl, kept in zip(row[1:], keep[start:end]) if kept]
+                start = end
+
                 if new_line_list:
-                    f_comp_samples.write(line_list[0] + "," + ",".join(new_line_list) + "\n")
+                    f_comp_samples.write(row[0] + "," + ",".join(new_line_list) + "\n")
                 else:
                     lost_samples += 1
 
+            lost_count += len(keep) - sum(keep)
+            total_count += len(keep)
+            total_samples += len(rows)
+
+            f_comp_samples.flush()
+            state["samples_offset"] = offset
+            record_sizes(city_splits_path, state, ["comp_samples.csv"])
+            save_state(city_splits_path, state)
+
+    if total_count:
         print(f"Lost gl images from comp filter in {city}: {lost_count} / {total_count} = {lost_count / total_count * 100:.2f}%")
+    if total_samples:
         print(f"Lost samples from comp filter in {city}: {lost_samples} / {total_samples} = {lost_samples / total_samples * 100:.2f}%")
-    
-
-    if not os.path.exists(os.path.join(city_splits_path, "train.csv")):
-        unused_count = 0
-        with (
-            open(os.path.join(city_splits_path, "comp_samples.csv"), "r") as f_samples, 
-            open(os.path.join(city_splits_path, "train.csv"), "w") as f_train, 
-            open(os.path.join(city_splits_path, "validation.csv"), "w") as f_val,
-            open(os.path.join(city_splits_path, "test.csv"), "w") as f_test,
-        ):
-            long_unit = (cities[city][2] - cities[city][0]) / N_REGIONS_SIDE
-            lat_unit = (cities[city][3] - cities[city][1]) / N_REGIONS_SIDE
-            lines = f_samples.readlines()
-            for line in lines:
-                aer_image_name = line.strip().split(',')[0]
-                bbox = aer_image_name[:-4].split("_")[1:]
-                bbox = [float(edge) for edge in bbox]
-
-                heat_data.add(((bbox[3] + bbox[1]) / 2, (bbox[2] + bbox[0]) / 2))
-
-                long_gl_diff = (bbox[2] - bbox[0]) / 4
-                lat_gl_diff = (bbox[3] - bbox[1]) / 4
-
-                left_region = int((bbox[0] + long_gl_diff - cities[city][0]) / long_unit)
-                bottom_region = int((bbox[1] + lat_gl_diff - cities[city][1]) / lat_unit)
-                right_region = int((bbox[2] - long_gl_diff - cities[city][0]) / long_unit)
-                top_region = int((bbox[3] - lat_gl_diff - cities[city][1]) / lat_unit)
-
-                corners = [
-                    (left_region, top_region),
-                    (left_region, bottom_region),
-                    (right_region, top_region),
-                    (right_region, bottom_region),
-                ]
-
-                if all(corner in train for corner in corners):
-                    f_train.write(line)
-                elif all(corner in val for corner in corners):
-                    f_val.write(line)
-                elif all(corner in test for corner in corners):
-                    f_test.write(line)
-                else:
-                    unused_count += 1
-
-        print(f"Lost samples from creating splits in {city}: {unused_count} / {len(lines)} = {unused_count / len(lines[1:]) * 100:.2f}%")
-
-        grid_cells = []
-        grid_values = []
-        for i, x in enumerate(np.arange(cities[city][0], cities[city][2], long_unit)):
-            for j, y in enumerate(np.arange(cities[city][1], cities[city][3], lat_unit)):
-                grid_cells.append(box(x, y, x+long_unit, y+lat_unit))
-                if (i, j) in train:
-                    grid_values.append("train")
-                elif (i, j) in val:
-                    grid_values.append("val")
-                elif (i, j) in test:
-                    grid_values.append("test")
-                else:
-                    grid_values.append("unused")
-
-        grid = gpd.GeoDataFrame(geometry=grid_cells, crs="EPSG:4326")
-        grid['value'] = grid_values
-
-        # Create folium map
-        m = folium.Map(location=[(cities[city][3] + cities[city][1]) / 2, (cities[city][2] + cities[city][0]) / 2], zoom_start=11)
-
-        # Create heatmap overlay
-        heatmap = folium.FeatureGroup(name='Heatmap')
-        HeatMap(heat_data).add_to(heatmap)
-        heatmap.add_to(m)
-
-        # Create train/val/test overlay
-        grid_overlay = folium.FeatureGroup(name='Train/Val/Test Split')
-        
-        # Add polygons to grid overlay
-        for _, row in grid.iterrows():
-            sim_geo = gpd.GeoSeries([row['geometry']]).__geo_interface__['features'][0]['geometry']
-            
-            # Define colors based on value
-            if row['value'] == "train":
-                color_hex = '#0000FF'  # blue
-            elif row['value'] == "val":
-                color_hex = '#FFA500'  # orange
-            elif row['value'] == "test":
-                color_hex = '#00FF00'  # green
-            else:  # unused
-                color_hex = '#FFFFFF'  # white
-                
-            folium.GeoJson(
-                sim_geo,
-                style_function=lambda feature, color=color_hex: {
-                    'fillColor': color,
-                    'color': 'black',
-                    'weight': 0.5,
-                    'fillOpacity': 0.6,
-                },
-                tooltip=f"Value: {row['value']}"
-            ).add_to(grid_overlay)
-        
-        grid_overlay.add_to(m)
-
-        # Add layer control to toggle overlays
-        folium.LayerControl().add_to(m)
-
-        m.save(os.path.join(city_splits_path, "grid_cells.html"))
-
-                    
\ No newline at end of file
+
+def split_new_samples(city, city_splits_path, state, labels, conn=None):
+    """Append comp_samples.csv rows added since the last run to the train/val/test files, and the manifest if given"""
+    comp_samples_path = os.path.join(city_splits_path, "comp_samples.csv")
+    if not os.path.exists(comp_samples_path) or os.path.getsize(comp_samples_path) <= state["comp_samples_offset"]:
+        return False
+
+    unused_count = 0
+    total_count = 0
+
+    truncate_outputs(city_splits_path, state, SPLIT_FILES.values())
+    split_files = {
+        split: open(os.path.join(city_splits_path, file_name), "a")
+        for split, file_name in SPLIT_FILES.items()
+    }
+    try:
+        for lines, offset in read_chunks(comp_samples_path, state["comp_samples_offset"]):
+            lines = [line.strip() for line in lines if line.strip()]
+            splits = assign_splits(parse_bboxes(lines), cities[city], labels)
+
+            for split, f_split in split_files.items():
+                split_lines = [lines[i] for i in np.flatnonzero(splits == split)]
+                f_split.writelines(line + "\n" for line in split_lines)
+                f_split.flush()
+
+                if conn is not None:
+                    with conn:
+                        manifest.set_splits(conn, SPLIT_NAMES[split], (line.split(",", 1)[0] for line in split_lines))
+
+            unused_count += int(np.count_nonzero(splits == UNUSED))
+            total_count += len(lines)
+
+            state["comp_samples_offset"] = offset
+            record_sizes(city_splits_path, state, SPLIT_FILES.values())
+            save_state(city_splits_path, state)
+    finally:
+        for f_split in split_files.values():
+            f_split.close()
+
+    if total_count:
+        print(f"Lost samples from creating splits in {city}: {unused_count} / {total_count} = {unused_count / total_count * 100:.2f}%")
+    return total_count > 0
+
+def create_split_map(city, city_splits_path, labels):
+    """Render the train/val/test region grid over a heatmap of sample centres"""
+    city_bounds = cities[city]
+
+    # Look up each cell's color from its split label, indexed so UNUSED (-1) picks the last entry
+    colors = np.array([SPLIT_COLORS[TRAIN], SPLIT_COLORS[VAL], SPLIT_COLORS[TEST], SPLIT_COLORS[UNUSED]], dtype=np.uint8)
+    grid_colors = colors[labels]
+
+    # Create folium map
+    m = folium.Map(location=[(city_bounds[3] + city_bounds[1]) / 2, (city_bounds[2] + city_bounds[0]) / 2], zoom_start=11)
+
+    # Create heatmap overlay
+    heatmap = folium.FeatureGroup(name='Heatmap')
+    bboxes = cached_sample_bboxes(os.path.join(city_splits_path, "comp_samples.csv"))
+    heat_data = np.unique(np.column_stack(((bboxes[:, 3] + bboxes[:, 1]) / 2, (bboxes[:, 2] + bboxes[:, 0]) / 2)), axis=0)
+    HeatMap(heat_data.tolist()).add_to(heatmap)
+    heatmap.add_to(m)
+
+    # Create train/val/test overlay as a single image rather than one layer per cell
+    add_grid_overlay(m, grid_colors, city_bounds, 'Train/Val/Test Split')
+
+    # Add layer control to toggle overlays
+    folium.LayerControl().add_to(m)
+
+    m.save(os.path.join(city_splits_path, "grid_cells.html"))
+
+def main():
+    """Filter, split and map every city with collected samples, only touching newly appended rows."""
+    conn = manifest.connect() if os.path.exists(manifest.MANIFEST_PATH) else None
+
+    for city in os.listdir(os.path.join("dataset", "splits")):
+        city_splits_path = os.path.join("dataset", "splits", city)
+        if city not in cities or not os.path.exists(os.path.join(city_splits_path, "samples.csv")):
+            print(f"Skipping {city} - no samples found")
+            continue
+
+        # An interrupted rebalance leaves the state pointing into the old files until it is finished
+        if finish_rebalance(city_splits_path):
+            print(f"Finished an interrupted rebalance of {city}")
+
+        try:
+            labels = load_region_labels(city, city_splits_path)
+        except ValueError as e:
+            print(f"{e}; splitting {city} again from scratch")
+            reset_splits(city_splits_path)
+            labels = load_region_labels(city, city_splits_path)
+        state = load_state(city_splits_path)
+
+        # Only read the manifest for cities it holds; other cities fall back to their CSVs
+        city_conn = conn if conn is not None and manifest.has_city(conn, city) else None
+        filter_new_samples(city, city_splits_path, state, city_conn)
+        split_changed = split_new_samples(city, city_splits_path, state, labels, city_conn)
+
+        if not os.path.exists(os.path.join(city_splits_path, "comp_samples.csv")):
+            continue
+        if split_changed or not os.path.exists(os.path.join(city_splits_path, "grid_cells.html")):
+            create_split_map(city, city_splits_path, labels)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import csv
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import manifest
+from create_dataset import GL_SAMPLES_MAX
+from manifest import SPLIT_FILES
+
+# Per ground-level image pose fields, in the order they appear in a batch's "poses" array
+POSE_FIELDS = [
+    "computed_rot_x",
+    "computed_rot_y",
+    "computed_rot_z",
+    "computed_latitude",
+    "computed_longitude",
+    "focal_length",
+]
+
+AERIAL_SIZE = (512, 512)
+GROUND_SIZE = (256, 256)
+
+def load_poses(city, conn=None):
+    """Load a city's ground-level pose fields into id-sorted arrays for searchsorted lookups
+
+    They come from the manifest when it holds the city, and from ground_metadata.csv otherwise.
+    """
+    if conn is not None and manifest.has_city(conn, city):
+        ids, poses = manifest.ground_fields(conn, city, POSE_FIELDS)
+    else:
+        ids, poses = manifest.read_ground_fields(os.path.join("dataset", "splits", city, "ground_metadata.csv"), POSE_FIELDS)
+    return ids, poses.astype(np.float32)
+
+def load_flagged(flagged_path):
+    """Aerial names of samples verify_dataset.py flagged for referencing a bad file"""
+    if not os.path.exists(flagged_path):
+        return set()
+    with open(flagged_path, "r", newline="") as f:
+        return {row["aerial"] for row in csv.DictReader(f)}
+
+def decode_image(path, size):
+    """Decode an image into a (height, width, 3) uint8 array of the given (width, height), returning it and the
+    image's original (width, height)
+
+    The image is scaled to fit, keeping its aspect ratio, and centred on a black background. Focal lengths are
+    relative to the longer side, so they still hold; the principal point moves by the padding the original
+    size implies.
+    """
+    with Image.open(path) as image:
+        original_size = image.size
+        scale = min(size[0] / original_size[0], size[1] / original_size[1])
+        fitted = (max(round(original_size[0] * scale), 1), max(round(original_size[1] * scale), 1))
+
+        # Let JPEG decode straight to a reduced scale when the target is much smaller
+        image.draft("RGB", fitted)
+        image = image.convert("RGB")
+        if image.size != fitted:
+            image = image.resize(fitted, Image.BILINEAR)
+
+        if fitted == tuple(size):
+            return np.asarray(image, dtype=np.uint8), original_size
+        canvas = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        left = (size[0] - fitted[0]) // 2
+        top = (size[1] - fitted[1]) // 2
+        canvas[top:top + fitted[1], left:left + fitted[0]] = np.asarray(image, dtype=np.uint8)
+        return canvas, original_size
+
+def load_sample(aerial_path, ground_paths, ground_poses, max_ground, aerial_size, ground_size, pad=True):
+    """Decode one sample's aerial tile and up to max_ground ground-level views, or return None if the tile is unreadable
+
+    With pad, the views, their original sizes and poses are padded to max_ground; otherwise they have one
+    entry per readable view.
+    """
+    try:
+        aerial, _ = decode_image(aerial_path, aerial_size)
+    except (OSError, ValueError):
+        # A sample is nothing without its tile, so it is skipped rather than failing the epoch
+        return None
+
+    grounds = []
+    sizes = []
+    poses = []
+    for path, pose in zip(ground_paths[:max_ground], ground_poses[:max_ground]):
+        try:
+            ground, size = decode_image(path, ground_size)
+        except (OSError, ValueError):
+            # Skip unreadable views rather than failing the batch
+            continue
+        grounds.append(ground)
+        sizes.append(size)
+        poses.append(pose)
+    count = len(grounds)
+
+    n = max_ground if pad else count
+    padded_grounds = np.zeros((n, ground_size[1], ground_size[0], 3), dtype=np.uint8)
+    padded_sizes = np.zeros((n, 2), dtype=np.int32)
+    padded_poses = np.full((n, len(POSE_FIELDS)), np.nan, dtype=np.float32)
+    if count:
+        padded_grounds[:count] = grounds
+        padded_sizes[:count] = sizes
+        padded_poses[:count] = poses
+    return aerial, padded_grounds, padded_sizes, padded_poses, count
+
+class DataLoader:
+    """Batched aerial tiles, ground-level views and poses for one split, decoded in a worker pool
+
+    Each batch is a dict of NumPy arrays:
+        aerial: (batch, height, width, 3) uint8
+        ground: (batch, max_ground, height, width, 3) uint8, zero padded
+        ground_sizes: (batch, max_ground, 2) int32, each view's original (width, height), zero padded
+        poses: (batch, max_ground, len(POSE_FIELDS)) float32, NaN padded
+        mask: (batch, max_ground) bool, True for real ground-level views
+
+    Views keep their aspect ratio inside ground_size, see decode_image. With pad=False, "ground",
+    "ground_sizes" and "poses" are instead lists holding one (views, ...) array per sample, and there is no
+    "mask". max_ground may then be None to keep every view.
+
+    Samples whose aerial tile can't be read are left out of their batch and counted in samples_skipped.
+    """
+
+    def __init__(
+        self,
+        split="train",
+        cities=None,
+        batch_size=32,
+        max_ground=GL_SAMPLES_MAX,
+        aerial_size=AERIAL_SIZE,
+        ground_size=GROUND_SIZE,
+        shuffle=True,
+        drop_last=False,
+        pad=True,
+        workers=os.cpu_count(),
+        prefetch=4,
+        use_processes=False,
+        seed=0,
+    ):
+        if pad and max_ground is None:
+            raise ValueError("max_ground is required when padding")
+
+        self.batch_size = batch_size
+        self.max_ground = max_ground
+        self.aerial_size = tuple(aerial_size)
+        self.ground_size = tuple(ground_size)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pad = pad
+        self.workers = workers
+        self.prefetch = prefetch
+        self.use_processes = use_processes
+        self.rng = np.random.default_rng(seed)
+
+        self.images_loaded = 0
+        self.samples_skipped = 0
+        self.started = None
+        self.wait_seconds = 0.0
+
+        splits_path = os.path.join("dataset", "splits")
+        if cities is None:
+            cities = sorted(os.listdir(splits_path))
+
+        conn = manifest.connect() if os.path.exists(manifest.MANIFEST_PATH) else None
+        self.samples = []
+        self.poses = {}
+        for city in cities:
+            split_path = os.path.join(splits_path, city, SPLIT_FILES[split])
+            if not os.path.exists(split_path):
+                continue
+            self.poses[city] = load_poses(city, conn)
+            flagged = load_flagged(os.path.join(splits_path, city, "flagged.csv"))
+            self.samples.extend(
+                (city, row[0], row[1:]) for row in manifest.read_rows(split_path) if row[0] not in flagged
+            )
+        if conn is not None:
+            conn.close()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.samples) // self.batch_size
+        return -(-len(self.samples) // self.batch_size)
+
+    @property
+    def images_per_sec(self):
+        """Images decoded per second of wall time since the current epoch started"""
+        if self.started is None:
+            return 0.0
+        return self.images_loaded / max(time.perf_counter() - self.started, 1e-9)
+
+    def sample_args(self, index):
+        city, aer_image_name, gl_image_names = self.samples[index]
+        ids, poses = self.poses[city]
+
+        gl_ids = np.array([int(gl[:-4]) for gl in gl_image_names], dtype=np.int64)
+        pos = np.minimum(np.searchsorted(ids, gl_ids), max(len(ids) - 1, 0))
+        gl_poses = np.full((len(gl_ids), len(POSE_FIELDS)), np.nan, dtype=np.float32)
+        if len(ids):
+            found = ids[pos] == gl_ids
+            gl_poses[found] = poses[pos[found]]
+
+        return (
+            os.path.join("dataset", city, "aerial", aer_image_name),
+            [os.path.join("dataset", city, "ground", gl) for gl in gl_image_names],
+            gl_poses,
+            self.max_ground,
+            self.aerial_size,
+            self.ground_size,
+            self.pad,
+        )
+
+    def collate(self, futures):
+        """Stack a batch's loaded samples, or return None if none of them could be loaded"""
+        results = [future.result() for future in futures]
+        loaded = [result for result in results if result is not None]
+        self.samples_skipped += len(results) - len(loaded)
+        if not loaded:
+            return None
+
+        aerials, grounds, sizes, poses, counts = zip(*loaded)
+        counts = np.array(counts)
+        self.images_loaded += len(aerials) + int(counts.sum())
+        if not self.pad:
+            return {"aerial": np.stack(aerials), "ground": list(grounds), "ground_sizes": list(sizes), "poses": list(poses)}
+        return {
+            "aerial": np.stack(aerials),
+            "ground": np.stack(grounds),
+            "ground_sizes": np.stack(sizes),
+            "poses": np.stack(poses),
+            "mask": np.arange(self.max_ground)[None, :] < counts[:, None],
+        }
+
+    def __iter__(self):
+        order = self.rng.permutation(len(self.samples)) if self.shuffle else np.arange(len(self.samples))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+
+        self.images_loaded = 0
+        self.samples_skipped = 0
+        self.wait_seconds = 0.0
+        self.started = time.perf_counter()
+
+        executor_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        executor = executor_class(max_workers=self.workers)
+
+        # Keep at most `prefetch` batches decoding ahead of the consumer
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append([executor.submit(load_sample, *self.sample_args(i)) for i in batch])
+                if len(pending) > self.prefetch:
+                    collated = self.timed_collate(pending.popleft())
+                    if collated is not None:
+                        yield collated
+            while pending:
+                collated = self.timed_collate(pending.popleft())
+                if collated is not None:
+                    yield collated
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def timed_collate(self, futures):
+        start = time.perf_counter()
+        batch = self.collate(futures)
+        # Time the consumer spends blocked on decode; near zero when prefetch keeps up
+        self.wait_seconds += time.perf_counter() - start
+        return batch
+
+def main():
+    """Run one epoch over a split and report decode throughput."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--split", default="train", choices=list(SPLIT_FILES))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--prefetch", type=int, default=4)
+    parser.add_argument("--processes", action="store_true", help="Decode in processes instead of threads")
+    parser.add_argument("--no-pad", action="store_true", help="Return ragged per-sample ground-level views")
+    args = parser.parse_args()
+
+    loader = DataLoader(
+        split=args.split,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        prefetch=args.prefetch,
+        use_processes=args.processes,
+        pad=not args.no_pad,
+    )
+    start = time.perf_counter()
+    for i, batch in enumerate(loader, start=1):
+        print(f"\rBatch {i}/{len(loader)}: {loader.images_per_sec:.0f} images/sec", end="")
+    print(f"\n{loader.images_loaded} images in {time.perf_counter() - start:.1f}s, {loader.wait_seconds:.1f}s waiting on decode")
+    if loader.samples_skipped:
+        print(f"Skipped {loader.samples_skipped} samples with an unreadable aerial tile")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
+import argparse
 import os
 import folium
-import geopandas as gpd
-from shapely.geometry import box
 import numpy as np
-from collections import defaultdict
+
+import manifest
+from grid_overlay import add_grid_overlay, add_grid_tiles, write_grid_tiles
+from sample_cache import cached_grid
 
 # Use the same cities dictionary from your original script
 cities = {
@@ -40,15 +42,73 @@ cities = {
 
 N_REGIONS_SIDE = 100
 
-def create_discrete_heatmap(city_name):
-    """Create a discrete heatmap showing image count per grid cell for a city."""
+HEATMAP_OPACITY = 0.7
+
+def heat_colormap():
+    """Build a 256-entry RGBA lookup table for the white -> yellow -> orange -> red count gradient"""
+    intensity = np.arange(256) / 255
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:, 0] = 255
+    lut[:, 1] = np.where(
+        intensity < 0.33,
+        255 * (intensity / 0.33),  # White to yellow
+        np.where(
+            intensity < 0.66,
+            255 * (1 - (intensity - 0.33) / 0.33),  # Yellow to orange
+            255 * (1 - intensity),  # Orange to red
+        ),
+    ).astype(np.uint8)
+    lut[:, 2] = np.where(intensity < 0.33, 255 * (1 - intensity / 0.33), 0).astype(np.uint8)
+    lut[0, :3] = 255  # white
+    lut[:, 3] = int(round(255 * HEATMAP_OPACITY))
+    return lut
+
+def count_cells(bboxes, city_bounds, n_regions_side=N_REGIONS_SIDE):
+    """Count, for every grid cell, the samples whose ground-level bbox covers it"""
+    long_unit = (city_bounds[2] - city_bounds[0]) / n_regions_side
+    lat_unit = (city_bounds[3] - city_bounds[1]) / n_regions_side
+
+    # Calculate which grid cells each image covers
+    long_gl_diff = (bboxes[:, 2] - bboxes[:, 0]) / 4
+    lat_gl_diff = (bboxes[:, 3] - bboxes[:, 1]) / 4
+
+    left_region = ((bboxes[:, 0] + long_gl_diff - city_bounds[0]) / long_unit).astype(np.int64)
+    bottom_region = ((bboxes[:, 1] + lat_gl_diff - city_bounds[1]) / lat_unit).astype(np.int64)
+    right_region = ((bboxes[:, 2] - long_gl_diff - city_bounds[0]) / long_unit).astype(np.int64)
+    top_region = ((bboxes[:, 3] - lat_gl_diff - city_bounds[1]) / lat_unit).astype(np.int64)
+
+    # Half-open cell ranges clipped to the grid
+    i_start = np.clip(left_region, 0, n_regions_side)
+    i_end = np.clip(right_region + 1, 0, n_regions_side)
+    j_start = np.clip(bottom_region, 0, n_regions_side)
+    j_end = np.clip(top_region + 1, 0, n_regions_side)
+    covers = (i_start < i_end) & (j_start < j_end)
+    i_start, i_end, j_start, j_end = i_start[covers], i_end[covers], j_start[covers], j_end[covers]
+
+    # 2D histogram of cell ranges: mark each rectangle's corners, then prefix-sum both axes
+    diff = np.zeros((n_regions_side + 1, n_regions_side + 1), dtype=np.int64)
+    np.add.at(diff, (i_start, j_start), 1)
+    np.add.at(diff, (i_end, j_start), -1)
+    np.add.at(diff, (i_start, j_end), -1)
+    np.add.at(diff, (i_end, j_end), 1)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:n_regions_side, :n_regions_side]
+
+def color_cells(cell_counts, max_count=None):
+    """Map an (n, n) count grid to RGBA colors scaled by max_count, by default the busiest cell"""
+    if max_count is None:
+        max_count = cell_counts.max() if cell_counts.size else 0
+    if max_count == 0:
+        return heat_colormap()[np.zeros(cell_counts.shape, dtype=np.int64)]
+
+    # Any non-zero count is at least the first non-white color
+    index = np.rint(np.minimum(cell_counts, max_count) * 255 / max_count).astype(np.int64)
+    index = np.where(cell_counts > 0, np.maximum(index, 1), 0)
+    return heat_colormap()[index]
+
+def create_discrete_heatmap(city_name, n_regions_side=N_REGIONS_SIDE, tile_zooms=None):
+    """Create a discrete heatmap showing image count per grid cell for a city, returning the counts."""
     
     city_bounds = cities[city_name]
-    long_unit = (city_bounds[2] - city_bounds[0]) / N_REGIONS_SIDE
-    lat_unit = (city_bounds[3] - city_bounds[1]) / N_REGIONS_SIDE
-    
-    # Dictionary to store image counts for each grid cell
-    cell_counts = defaultdict(int)
     
     # Read samples and count images per cell
     city_splits_path = os.path.join("dataset", "splits", city_name)
@@ -58,41 +118,20 @@ def create_discrete_heatmap(city_name):
         print(f"Samples file not found for {city_name}")
         return
     
-    with open(samples_file, "r") as f_samples:
-        lines = f_samples.readlines()
-        for line in lines[1:]:  # Skip header
-            aer_image_name = line.strip().split(',')[0]
-            bbox = aer_image_name[:-4].split("_")[1:]
-            bbox = [float(edge) for edge in bbox]
-            
-            # Calculate which grid cells this image covers
-            long_gl_diff = (bbox[2] - bbox[0]) / 4
-            lat_gl_diff = (bbox[3] - bbox[1]) / 4
-            
-            left_region = int((bbox[0] + long_gl_diff - city_bounds[0]) / long_unit)
-            bottom_region = int((bbox[1] + lat_gl_diff - city_bounds[1]) / lat_unit)
-            right_region = int((bbox[2] - long_gl_diff - city_bounds[0]) / long_unit)
-            top_region = int((bbox[3] - lat_gl_diff - city_bounds[1]) / lat_unit)
-            
-            # Count this image for all cells it covers
-            for i in range(left_region, right_region + 1):
-                for j in range(bottom_region, top_region + 1):
-                    if 0 <= i < N_REGIONS_SIDE and 0 <= j < N_REGIONS_SIDE:
-                        cell_counts[(i, j)] += 1
-    
-    # Create grid cells for visualization
-    grid_cells = []
-    grid_values = []
-    max_count = max(cell_counts.values()) if cell_counts else 0
-    
-    for i, x in enumerate(np.arange(city_bounds[0], city_bounds[2], long_unit)):
-        for j, y in enumerate(np.arange(city_bounds[1], city_bounds[3], lat_unit)):
-            grid_cells.append(box(x, y, x + long_unit, y + lat_unit))
-            count = cell_counts.get((i, j), 0)
-            grid_values.append(count)
-    
-    grid = gpd.GeoDataFrame(geometry=grid_cells, crs="EPSG:4326")
-    grid['count'] = grid_values
+    # The manifest's bbox index answers this directly; otherwise parse the samples file, cached between runs
+    conn = manifest.connect() if os.path.exists(manifest.MANIFEST_PATH) else None
+    if conn is not None and manifest.has_city(conn, city_name):
+        cell_counts = count_cells(manifest.sample_bboxes(conn, city_name), city_bounds, n_regions_side)
+    else:
+        cell_counts = cached_grid(
+            samples_file,
+            "cell_counts",
+            [*city_bounds, n_regions_side],
+            lambda bboxes: count_cells(bboxes, city_bounds, n_regions_side),
+        )
+    if conn is not None:
+        conn.close()
+    max_count = int(cell_counts.max()) if cell_counts.size else 0
     
     # Create folium map
     m = folium.Map(
@@ -100,54 +139,13 @@ def create_discrete_heatmap(city_name):
         zoom_start=11
     )
     
-    # Create discrete heatmap overlay
-    heatmap_overlay = folium.FeatureGroup(name='Image Count Heatmap')
-    
-    # Add polygons to heatmap overlay with color based on count
-    for _, row in grid.iterrows():
-        sim_geo = gpd.GeoSeries([row['geometry']]).__geo_interface__['features'][0]['geometry']
-        
-        # Color gradient from white (0) to red (max_count)
-        count = row['count']
-        if max_count > 0:
-            intensity = count / max_count
-        else:
-            intensity = 0
-        
-        # Create color gradient: white -> yellow -> orange -> red
-        if intensity == 0:
-            color_hex = '#FFFFFF'  # white
-        elif intensity < 0.33:
-            # White to yellow
-            r = int(255)
-            g = int(255 * (intensity / 0.33))
-            b = int(255 * (1 - intensity / 0.33))
-            color_hex = f'#{r:02x}{g:02x}{b:02x}'
-        elif intensity < 0.66:
-            # Yellow to orange
-            r = 255
-            g = int(255 * (1 - (intensity - 0.33) / 0.33))
-            b = 0
-            color_hex = f'#{r:02x}{g:02x}{b:02x}'
-        else:
-            # Orange to red
-            r = 255
-            g = int(255 * (1 - intensity))
-            b = 0
-            color_hex = f'#{r:02x}{g:02x}{b:02x}'
-        
-        folium.GeoJson(
-            sim_geo,
-            style_function=lambda feature, color=color_hex: {
-                'fillColor': color,
-                'color': 'black',
-                'weight': 0.5,
-                'fillOpacity': 0.7,
-            },
-            tooltip=f"Image Count: {row['count']}"
-        ).add_to(heatmap_overlay)
-    
-    heatmap_overlay.add_to(m)
+    # Create discrete heatmap overlay as one image, or as zoomable tiles when requested
+    colors = color_cells(cell_counts)
+    if tile_zooms:
+        write_grid_tiles(colors, city_bounds, os.path.join(city_splits_path, "heatmap_tiles"), tile_zooms)
+        add_grid_tiles(m, "heatmap_tiles", tile_zooms, 'Image Count Heatmap')
+    else:
+        add_grid_overlay(m, colors, city_bounds, 'Image Count Heatmap')
     
     # Add layer control
     folium.LayerControl().add_to(m)
@@ -158,16 +156,27 @@ def create_discrete_heatmap(city_name):
     
     print(f"Discrete heatmap created for {city_name}")
     print(f"Max images per cell: {max_count}")
-    print(f"Total cells with images: {len([v for v in cell_counts.values() if v > 0])}")
+    print(f"Total cells with images: {int(np.count_nonzero(cell_counts))}")
     print(f"Output saved to: {output_path}")
 
+    return cell_counts
+
 def main():
     """Create discrete heatmaps for all cities."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--regions", type=int, default=N_REGIONS_SIDE, help="Grid cells per side")
+    parser.add_argument(
+        "--tiles", type=int, nargs=2, metavar=("MIN_ZOOM", "MAX_ZOOM"),
+        help="Write multi-resolution tiles for these zoom levels instead of a single image overlay",
+    )
+    args = parser.parse_args()
+    tile_zooms = range(args.tiles[0], args.tiles[1] + 1) if args.tiles else None
+
     for city in cities.keys():
         city_splits_path = os.path.join("dataset", "splits", city)
         if os.path.exists(city_splits_path):
             print(f"\nProcessing {city}...")
-            create_discrete_heatmap(city)
+            create_discrete_heatmap(city, args.regions, tile_zooms)
         else:
             print(f"Skipping {city} - no dataset found")
 
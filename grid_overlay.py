@@ -0,0 +1,97 @@
+import os
+
+import folium
+import numpy as np
+from PIL import Image
+
+# Largest side, in pixels, of a rendered grid image
+MAX_IMAGE_SIDE = 1024
+
+# Cells narrower than this many pixels are drawn without outlines
+MIN_OUTLINED_CELL_PX = 4
+
+OUTLINE_RGBA = (0, 0, 0, 255)
+
+TILE_SIZE = 256
+
+def hex_to_rgba(color_hex, opacity=1.0):
+    """Convert a '#RRGGBB' color and fill opacity into a uint8 RGBA tuple"""
+    return tuple(int(color_hex[i:i + 2], 16) for i in (1, 3, 5)) + (int(round(255 * opacity)),)
+
+def grid_image(colors):
+    """Turn an (n_lng, n_lat, 4) RGBA cell grid into a north-up image, outlining cells when there's room"""
+    # Grid cells are indexed (longitude, latitude) from the south-west corner; images are (row, column) from the top
+    image = np.transpose(colors, (1, 0, 2))[::-1]
+
+    cell_px = MAX_IMAGE_SIDE // max(image.shape[:2])
+    if cell_px >= MIN_OUTLINED_CELL_PX:
+        image = np.repeat(np.repeat(image, cell_px, axis=0), cell_px, axis=1)
+        image[::cell_px, :] = OUTLINE_RGBA
+        image[:, ::cell_px] = OUTLINE_RGBA
+        image[-1, :] = OUTLINE_RGBA
+        image[:, -1] = OUTLINE_RGBA
+
+    return np.ascontiguousarray(image, dtype=np.uint8)
+
+def add_grid_overlay(parent, colors, bounds, name):
+    """Add a cell grid to a folium map as a single georeferenced PNG, so the HTML size doesn't grow with the grid"""
+    folium.raster_layers.ImageOverlay(
+        image=grid_image(colors),
+        bounds=[[bounds[1], bounds[0]], [bounds[3], bounds[2]]],
+        pixelated=True,
+        name=name,
+    ).add_to(parent)
+
+def tile_range(bounds, zoom):
+    """Web Mercator x and y tile index ranges covering a (west, south, east, north) bbox"""
+    n = 2 ** zoom
+
+    def tile_x(lng):
+        return min(n - 1, int((lng + 180) / 360 * n))
+
+    def tile_y(lat):
+        lat = np.radians(lat)
+        return min(n - 1, int((1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n))
+
+    return range(tile_x(bounds[0]), tile_x(bounds[2]) + 1), range(tile_y(bounds[3]), tile_y(bounds[1]) + 1)
+
+def write_grid_tiles(colors, bounds, out_dir, zooms):
+    """Write an (n_lng, n_lat, 4) RGBA cell grid as {z}/{x}/{y}.png tiles for the given zoom levels"""
+    n_lng, n_lat = colors.shape[:2]
+    long_unit = (bounds[2] - bounds[0]) / n_lng
+    lat_unit = (bounds[3] - bounds[1]) / n_lat
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+
+    for zoom in zooms:
+        n = 2 ** zoom
+        x_range, y_range = tile_range(bounds, zoom)
+        for x in x_range:
+            # Cell column under each pixel column of the tile
+            lng = (x + offsets) / n * 360 - 180
+            i = np.floor((lng - bounds[0]) / long_unit).astype(np.int64)
+
+            os.makedirs(os.path.join(out_dir, str(zoom), str(x)), exist_ok=True)
+            for y in y_range:
+                # Cell row under each pixel row of the tile
+                lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+                j = np.floor((lat - bounds[1]) / lat_unit).astype(np.int64)
+
+                inside = ((j >= 0) & (j < n_lat))[:, None] & ((i >= 0) & (i < n_lng))[None, :]
+                tile = colors[np.clip(i, 0, n_lng - 1)[None, :], np.clip(j, 0, n_lat - 1)[:, None]]
+                tile[~inside] = 0
+
+                Image.fromarray(np.ascontiguousarray(tile, dtype=np.uint8), "RGBA").save(
+                    os.path.join(out_dir, str(zoom), str(x), f"{y}.png")
+                )
+
+def add_grid_tiles(parent, tiles_dir, zooms, name):
+    """Add tiles written by write_grid_tiles, relative to the saved map, as a zoomable overlay"""
+    folium.TileLayer(
+        tiles=f"{tiles_dir}/{{z}}/{{x}}/{{y}}.png",
+        attr=name,
+        name=name,
+        overlay=True,
+        min_zoom=min(zooms),
+        max_native_zoom=max(zooms),
+        max_zoom=max(max(zooms), 19),
+    ).add_to(parent)
@@ -0,0 +1,299 @@
+import argparse
+import csv
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_PATH = os.path.join("dataset", "manifest.sqlite")
+
+# Ground-level metadata columns and their SQLite types, in the order create_dataset.py writes them
+GROUND_COLUMNS = {
+    "id": "INTEGER",
+    "captured_at": "INTEGER",
+    "height": "INTEGER",
+    "sequence": "TEXT",
+    "altitude": "REAL",
+    "computed_altitude": "REAL",
+    "compass_angle": "REAL",
+    "computed_compass_angle": "REAL",
+    "latitude": "REAL",
+    "longitude": "REAL",
+    "computed_latitude": "REAL",
+    "computed_longitude": "REAL",
+    "computed_rot_x": "REAL",
+    "computed_rot_y": "REAL",
+    "computed_rot_z": "REAL",
+    "focal_length": "REAL",
+    "radial_k1": "REAL",
+    "radial_k2": "REAL",
+}
+
+SPLIT_FILES = {"train": "train.csv", "validation": "validation.csv", "test": "test.csv"}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS cities (
+    city TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    city TEXT NOT NULL,
+    aerial TEXT NOT NULL UNIQUE,
+    west REAL NOT NULL,
+    south REAL NOT NULL,
+    east REAL NOT NULL,
+    north REAL NOT NULL
+);
+-- Covers a city's bboxes, and bbox range queries within a city
+CREATE INDEX IF NOT EXISTS samples_bounds ON samples (city, west, south, east, north);
+
+CREATE TABLE IF NOT EXISTS ground_images (
+    id INTEGER PRIMARY KEY,
+    city TEXT NOT NULL,
+    {", ".join(f"{column} {column_type}" for column, column_type in list(GROUND_COLUMNS.items())[1:])}
+);
+CREATE INDEX IF NOT EXISTS ground_images_city ON ground_images (city);
+
+CREATE TABLE IF NOT EXISTS sample_ground (
+    sample_id INTEGER NOT NULL REFERENCES samples (id) ON DELETE CASCADE,
+    ground_id INTEGER NOT NULL,
+    PRIMARY KEY (sample_id, ground_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sample_ground_ground ON sample_ground (ground_id);
+
+CREATE TABLE IF NOT EXISTS sample_splits (
+    sample_id INTEGER PRIMARY KEY REFERENCES samples (id) ON DELETE CASCADE,
+    split TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sample_splits_split ON sample_splits (split);
+
+CREATE TABLE IF NOT EXISTS files (
+    city TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT,
+    error TEXT,
+    PRIMARY KEY (city, folder, name)
+) WITHOUT ROWID;
+"""
+
+# Changes for manifests made by earlier versions, applied in order; PRAGMA user_version counts those applied
+MIGRATIONS = [
+    # The sample_bounds R*Tree and the city-only index gave way to samples_bounds
+    "DROP TABLE IF EXISTS sample_bounds; DROP INDEX IF EXISTS samples_city;",
+]
+
+def connect(path=MANIFEST_PATH):
+    """Open the manifest, creating its tables on first use"""
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version < len(MIGRATIONS):
+        migrate_schema(conn)
+    return conn
+
+def migrate_schema(conn):
+    """Apply the migrations a manifest hasn't had yet"""
+    conn.execute("BEGIN IMMEDIATE")
+    # Another process may have migrated while this one waited for the lock
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    for migration in MIGRATIONS[version:]:
+        for statement in filter(str.strip, migration.split(";")):
+            conn.execute(statement)
+    conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    conn.execute("COMMIT")
+
+def connect_complete(path=MANIFEST_PATH):
+    """Open the manifest, first loading every city under dataset/splits if it doesn't exist yet
+
+    Scripts read a city from the manifest once it holds that city, so a new manifest shouldn't start
+    with only the cities one script happened to touch.
+    """
+    created = not os.path.exists(path)
+    conn = connect(path)
+    if created:
+        for city in dataset_cities():
+            migrate_city(conn, city)
+    return conn
+
+def dataset_cities():
+    """Cities with a samples file under dataset/splits"""
+    splits_path = os.path.join("dataset", "splits")
+    if not os.path.isdir(splits_path):
+        return []
+    return [
+        city for city in sorted(os.listdir(splits_path))
+        if os.path.exists(os.path.join(splits_path, city, "samples.csv"))
+    ]
+
+def parse_bbox(aer_image_name):
+    return [float(edge) for edge in aer_image_name[:-4].split("_")[1:]]
+
+def add_ground_images(conn, city, gl_rows):
+    """Insert or refresh ground-level metadata rows, given as dicts keyed by GROUND_COLUMNS"""
+    conn.executemany(
+        f"INSERT OR REPLACE INTO ground_images (city, {', '.join(GROUND_COLUMNS)}) "
+        f"VALUES (?, {', '.join('?' * len(GROUND_COLUMNS))})",
+        ([city] + [gl_row.get(column) for column in GROUND_COLUMNS] for gl_row in gl_rows),
+    )
+
+def add_sample(conn, city, aer_image_name, gl_image_names):
+    """Record a sample, its bbox and its ground-level images"""
+    bbox = parse_bbox(aer_image_name)
+    sample_id = conn.execute(
+        "INSERT INTO samples (city, aerial, west, south, east, north) VALUES (?, ?, ?, ?, ?, ?)",
+        [city, aer_image_name, *bbox],
+    ).lastrowid
+    conn.executemany(
+        "INSERT OR IGNORE INTO sample_ground (sample_id, ground_id) VALUES (?, ?)",
+        ((sample_id, int(gl[:-4])) for gl in gl_image_names),
+    )
+    return sample_id
+
+def set_splits(conn, split, aer_image_names):
+    """Record which split a batch of samples belongs to"""
+    conn.executemany(
+        "INSERT OR REPLACE INTO sample_splits (sample_id, split) SELECT id, ? FROM samples WHERE aerial = ?",
+        ((split, aer_image_name) for aer_image_name in aer_image_names),
+    )
+
+def add_city(conn, city):
+    """Mark a city's manifest entries as complete, so scripts may read them instead of the CSVs"""
+    conn.execute("INSERT OR IGNORE INTO cities (city) VALUES (?)", [city])
+
+def has_city(conn, city):
+    """Whether the manifest holds all of a city's samples; if not, its CSVs are the only full record"""
+    return conn.execute("SELECT 1 FROM cities WHERE city = ?", [city]).fetchone() is not None
+
+def mark_incomplete(conn, city):
+    """Stop scripts reading a city from the manifest, leaving its CSVs as the full record until it is migrated again"""
+    conn.execute("DELETE FROM cities WHERE city = ?", [city])
+
+def remove_city(conn, city):
+    """Drop everything recorded for a city"""
+    mark_incomplete(conn, city)
+    conn.execute("DELETE FROM samples WHERE city = ?", [city])
+    conn.execute("DELETE FROM ground_images WHERE city = ?", [city])
+
+def read_rows(path):
+    """Sample rows (aerial name followed by ground-level names) from a samples or split CSV"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            row = line.strip().split(",")
+            # Skip headers and blank lines
+            if row[0].startswith("aerial_"):
+                yield row
+
+def migrate_city(conn, city):
+    """Rebuild a city's manifest entries from its samples, metadata and split CSVs"""
+    city_splits_path = os.path.join("dataset", "splits", city)
+    with conn:
+        remove_city(conn, city)
+
+        metadata_path = os.path.join(city_splits_path, "ground_metadata.csv")
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r", newline="") as f:
+                add_ground_images(conn, city, csv.DictReader(f))
+
+        for row in read_rows(os.path.join(city_splits_path, "samples.csv")):
+            # Duplicate aerial names can only come from a repeated point, so keep the first
+            if conn.execute("SELECT 1 FROM samples WHERE aerial = ?", [row[0]]).fetchone() is None:
+                add_sample(conn, city, row[0], row[1:])
+
+        for split, file_name in SPLIT_FILES.items():
+            set_splits(conn, split, (row[0] for row in read_rows(os.path.join(city_splits_path, file_name))))
+
+        add_city(conn, city)
+
+def sample_bboxes(conn, city):
+    """(n, 4) array of a city's sample bboxes, in the order the samples were added"""
+    rows = conn.execute("SELECT west, south, east, north FROM samples WHERE city = ? ORDER BY id", [city]).fetchall()
+    return np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+def sample_bounds(conn, city):
+    """Map each of a city's aerial names to its [west, south, east, north] bbox, in the order the samples were added"""
+    return {
+        aerial: [west, south, east, north] for aerial, west, south, east, north in conn.execute(
+            "SELECT aerial, west, south, east, north FROM samples WHERE city = ? ORDER BY id", [city]
+        )
+    }
+
+def ground_fields(conn, city, fields):
+    """Id-sorted array of a city's ground-level ids and an (n, len(fields)) array of those GROUND_COLUMNS, for
+    searchsorted lookups; missing values are NaN"""
+    rows = conn.execute(
+        f"SELECT id, {', '.join(fields)} FROM ground_images WHERE city = ? ORDER BY id", [city]
+    ).fetchall()
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, len(fields))
+    return np.array([row[0] for row in rows], dtype=np.int64), values
+
+def read_ground_fields(metadata_path, fields):
+    """ground_fields from a ground_metadata.csv, keeping the first row of each id; absent columns are NaN"""
+    df = pd.read_csv(metadata_path, usecols=lambda column: column == "id" or column in fields)
+    df = df.drop_duplicates("id").sort_values("id")
+    return df["id"].to_numpy(dtype=np.int64), df.reindex(columns=fields).to_numpy(dtype=np.float64)
+
+def ground_coordinates(conn, city):
+    """Id-sorted arrays of a city's ground-level ids and computed coordinates"""
+    ids, coordinates = ground_fields(conn, city, ["computed_latitude", "computed_longitude"])
+    return ids, coordinates[:, 0], coordinates[:, 1]
+
+def referenced_files(conn, city):
+    """Aerial and ground-level file names referenced by a city's samples"""
+    aerial = {name for (name,) in conn.execute("SELECT aerial FROM samples WHERE city = ?", [city])}
+    ground = {
+        f"{ground_id}.jpg" for (ground_id,) in conn.execute(
+            "SELECT DISTINCT sample_ground.ground_id FROM sample_ground "
+            "JOIN samples ON samples.id = sample_ground.sample_id WHERE samples.city = ?",
+            [city],
+        )
+    }
+    return aerial, ground
+
+def verified_files(conn, city, folder):
+    """Map each verified file name in a city's folder to its recorded (size, mtime_ns, error)"""
+    return {
+        name: (size, mtime_ns, error) for name, size, mtime_ns, error in conn.execute(
+            "SELECT name, size, mtime_ns, error FROM files WHERE city = ? AND folder = ?", [city, folder]
+        )
+    }
+
+def record_files(conn, results):
+    """Record verification results given as (city, folder, name, size, mtime_ns, sha256, error) tuples"""
+    conn.executemany(
+        "INSERT OR REPLACE INTO files (city, folder, name, size, mtime_ns, sha256, error) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        results,
+    )
+
+def forget_files(conn, city, folder, names):
+    conn.executemany(
+        "DELETE FROM files WHERE city = ? AND folder = ? AND name = ?",
+        ([city, folder, name] for name in names),
+    )
+
+def main():
+    """Build or rebuild the SQLite manifest from an existing dataset/ tree."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("cities", nargs="*", help="Cities to migrate (default: all under dataset/splits)")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    args = parser.parse_args()
+
+    city_names = args.cities or dataset_cities()
+
+    conn = connect(args.manifest)
+    for city in city_names:
+        migrate_city(conn, city)
+        (samples,) = conn.execute("SELECT COUNT(*) FROM samples WHERE city = ?", [city]).fetchone()
+        print(f"Migrated {city}: {samples} samples")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
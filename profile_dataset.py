@@ -0,0 +1,152 @@
+import argparse
+import csv
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+import manifest
+
+def list_sizes(folder_path):
+    """Map each file name in a folder to its size in bytes"""
+    sizes = {}
+    if not os.path.isdir(folder_path):
+        return sizes
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                sizes[entry.name] = entry.stat().st_size
+    return sizes
+
+def format_timestamp(captured_at):
+    if captured_at is None:
+        return None
+    return datetime.fromtimestamp(captured_at / 1000, tz=timezone.utc).isoformat()
+
+def profile_city(city):
+    """Profile one city's samples, metadata and image files in a single pass over each"""
+    city_splits_path = os.path.join("dataset", "splits", city)
+    aerial_sizes = list_sizes(os.path.join("dataset", city, "aerial"))
+    ground_sizes = list_sizes(os.path.join("dataset", city, "ground"))
+
+    ground_per_sample = Counter()
+    missing_aerial = 0
+    missing_ground = set()
+    for row in manifest.read_rows(os.path.join(city_splits_path, "samples.csv")):
+        ground_per_sample[len(row) - 1] += 1
+        if row[0] not in aerial_sizes:
+            missing_aerial += 1
+        missing_ground.update(gl for gl in row[1:] if gl not in ground_sizes)
+
+    metadata_rows = 0
+    first_captured = None
+    last_captured = None
+    metadata_path = os.path.join(city_splits_path, "ground_metadata.csv")
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r", newline="") as f_metadata:
+            for row in csv.DictReader(f_metadata):
+                metadata_rows += 1
+                try:
+                    captured_at = int(float(row["captured_at"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                first_captured = captured_at if first_captured is None else min(first_captured, captured_at)
+                last_captured = captured_at if last_captured is None else max(last_captured, captured_at)
+
+    return {
+        "city": city,
+        "samples": sum(ground_per_sample.values()),
+        "ground_references": sum(count * n for count, n in ground_per_sample.items()),
+        "ground_per_sample": {str(count): n for count, n in sorted(ground_per_sample.items())},
+        "metadata_rows": metadata_rows,
+        "aerial_files": len(aerial_sizes),
+        "aerial_bytes": sum(aerial_sizes.values()),
+        "ground_files": len(ground_sizes),
+        "ground_bytes": sum(ground_sizes.values()),
+        "missing_aerial": missing_aerial,
+        "missing_ground": len(missing_ground),
+        "first_captured_at": format_timestamp(first_captured),
+        "last_captured_at": format_timestamp(last_captured),
+    }
+
+def plot_ground_per_sample(reports, output_path):
+    """Histogram of ground-level images per sample, stacked by city"""
+    max_count = max((int(count) for report in reports for count in report["ground_per_sample"]), default=0)
+    counts = list(range(max_count + 1))
+
+    plt.figure(figsize=(10, 5))
+    bottom = [0] * len(counts)
+    for report in reports:
+        heights = [report["ground_per_sample"].get(str(count), 0) for count in counts]
+        plt.bar(counts, heights, bottom=bottom, label=report["city"], edgecolor='black', linewidth=0.3)
+        bottom = [b + h for b, h in zip(bottom, heights)]
+    plt.xlabel("Ground-level images per sample")
+    plt.ylabel("Samples")
+    plt.title("Distribution of Ground-Level Images Per Sample")
+    if reports:
+        plt.legend(fontsize="small", ncol=2)
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+
+def plot_city_counts(reports, output_path):
+    """Samples and ground-level files per city"""
+    cities = [report["city"] for report in reports]
+    positions = range(len(cities))
+
+    plt.figure(figsize=(max(6, len(cities) * 0.6), 5))
+    plt.bar([p - 0.2 for p in positions], [report["samples"] for report in reports], width=0.4, label="Samples")
+    plt.bar([p + 0.2 for p in positions], [report["ground_files"] for report in reports], width=0.4, label="Ground-level files")
+    plt.xticks(list(positions), cities, rotation=45, ha="right")
+    plt.ylabel("Count")
+    plt.title("Samples and Ground-Level Images Per City")
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+
+def main():
+    """Profile every city's samples, metadata and files in parallel, writing a JSON report and PNG charts."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--output", default=os.path.join("dataset", "profile"), help="Directory for the report and charts")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    city_names = [
+        city for city in os.listdir(os.path.join("dataset", "splits"))
+        if os.path.exists(os.path.join("dataset", "splits", city, "samples.csv"))
+    ]
+
+    reports = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(profile_city, city) for city in city_names]
+        for future in as_completed(futures):
+            reports.append(future.result())
+    reports.sort(key=lambda report: report["city"])
+
+    totals = {
+        key: sum(report[key] for report in reports)
+        for key in (
+            "samples", "ground_references", "metadata_rows", "aerial_files", "aerial_bytes",
+            "ground_files", "ground_bytes", "missing_aerial", "missing_ground",
+        )
+    }
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "report.json"), "w") as f:
+        json.dump({"totals": totals, "cities": reports}, f, indent=2)
+    plot_ground_per_sample(reports, os.path.join(args.output, "ground_per_sample.png"))
+    plot_city_counts(reports, os.path.join(args.output, "city_counts.png"))
+
+    print(f"{totals['samples']} samples across {len(reports)} cities, "
+          f"{(totals['aerial_bytes'] + totals['ground_bytes']) / 1e9:.2f} GB of images, "
+          f"{totals['missing_aerial']} aerial and {totals['missing_ground']} ground-level files missing")
+    print(f"Report saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import manifest
+from create_dataset import GL_SAMPLES_MAX
+from discrete_heatmap import cities
+
+# Files whose rows are an aerial image followed by its ground-level images
+ROW_FILES = ["comp_samples.csv", "train.csv", "validation.csv", "test.csv"]
+
+# Written once every temp file of a rebalance is complete, and removed once they are all in place
+PENDING_FILE = "rebalance_pending.json"
+
+def sample_cell(aer_image_name, city_bounds, n_regions_side):
+    """Grid cell containing a sample's centre, clamped to the city grid"""
+    bbox = manifest.parse_bbox(aer_image_name)
+    i = int(((bbox[0] + bbox[2]) / 2 - city_bounds[0]) / (city_bounds[2] - city_bounds[0]) * n_regions_side)
+    j = int(((bbox[1] + bbox[3]) / 2 - city_bounds[1]) / (city_bounds[3] - city_bounds[1]) * n_regions_side)
+    return min(max(i, 0), n_regions_side - 1), min(max(j, 0), n_regions_side - 1)
+
+def cap_row(row, max_ground, rng):
+    """Keep a seeded random subset of at most max_ground ground-level images, in their original order"""
+    if len(row) - 1 <= max_ground:
+        return row
+    keep = set(rng.sample(range(1, len(row)), max_ground))
+    return [row[0]] + [gl for i, gl in enumerate(row[1:], start=1) if i in keep]
+
+def rewrite_file(path, transform, offset=None):
+    """Stream a file line by line through transform into a temp file
+
+    Returns the temp path and the output byte offset matching the input byte offset, so split
+    progress recorded against the old file still points at the same row boundary.
+    """
+    tmp_path = f"{path}.tmp"
+    in_pos = 0
+    out_pos = 0
+    new_offset = None
+    with open(path, "rb") as f_in, open(tmp_path, "wb") as f_out:
+        for line in f_in:
+            if offset is not None and new_offset is None and in_pos >= offset:
+                new_offset = out_pos
+            in_pos += len(line)
+
+            new_line = transform(line)
+            if new_line:
+                f_out.write(new_line)
+                out_pos += len(new_line)
+    return tmp_path, out_pos if new_offset is None else new_offset
+
+CHANGES_SCHEMA = """
+CREATE TABLE changed (aerial TEXT PRIMARY KEY, kept TEXT) WITHOUT ROWID;
+CREATE TABLE removed (name TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE kept_ground (name TEXT PRIMARY KEY) WITHOUT ROWID;
+"""
+
+def open_changes(path):
+    """Scratch database for what a rebalance changed, so memory doesn't grow with the samples file"""
+    if os.path.exists(path):
+        os.remove(path)
+    changes = sqlite3.connect(path)
+    changes.execute("PRAGMA journal_mode=OFF")
+    changes.execute("PRAGMA synchronous=OFF")
+    changes.executescript(CHANGES_SCHEMA)
+    return changes
+
+def record_row(changes, row, new_row):
+    """Record a sample's ground-level images as kept, and what capping or dropping it removed"""
+    if new_row is None:
+        changes.execute("INSERT OR REPLACE INTO changed (aerial, kept) VALUES (?, NULL)", [row[0]])
+        changes.executemany("INSERT OR IGNORE INTO removed (name) VALUES (?)", ((gl,) for gl in row[1:]))
+        return
+    if len(new_row) < len(row):
+        changes.execute("INSERT OR REPLACE INTO changed (aerial, kept) VALUES (?, ?)", [row[0], ",".join(new_row[1:])])
+        kept = set(new_row[1:])
+        changes.executemany("INSERT OR IGNORE INTO removed (name) VALUES (?)", ((gl,) for gl in row[1:] if gl not in kept))
+    changes.executemany("INSERT OR IGNORE INTO kept_ground (name) VALUES (?)", ((gl,) for gl in new_row[1:]))
+
+def rebalance_samples(samples_path, city_bounds, max_ground, max_per_cell, n_regions_side, rng, offset, changes):
+    """Cap samples.csv into a temp file, recording what changed in `changes` so the other files can follow"""
+
+    def cap(line):
+        row = line.decode().strip().split(",")
+        if not row[0].startswith("aerial_"):
+            return line, None
+        return (",".join(cap_row(row, max_ground, rng)) + "\n").encode(), row
+
+    if not max_per_cell:
+        def cap_and_record(line):
+            new_line, row = cap(line)
+            if row is not None:
+                record_row(changes, row, new_line.decode().strip().split(","))
+            return new_line
+
+        return rewrite_file(samples_path, cap_and_record, offset)
+
+    # Seeded reservoir of at most max_per_cell samples per grid cell, holding (line index, line, original row)
+    reservoirs = {}
+    seen = {}
+    boundary = None
+    in_pos = 0
+    index = -1
+    with open(samples_path, "rb") as f_in:
+        passthrough = []
+        for index, line in enumerate(f_in):
+            if boundary is None and in_pos >= offset:
+                boundary = index
+            in_pos += len(line)
+
+            new_line, row = cap(line)
+            if row is None:
+                passthrough.append((index, new_line, None))
+                continue
+
+            cell = sample_cell(row[0], city_bounds, n_regions_side)
+            reservoir = reservoirs.setdefault(cell, [])
+            seen[cell] = seen.get(cell, 0) + 1
+
+            item = (index, new_line, row)
+            if len(reservoir) < max_per_cell:
+                reservoir.append(item)
+                continue
+
+            slot = rng.randrange(seen[cell])
+            if slot < max_per_cell:
+                reservoir[slot], item = item, reservoir[slot]
+
+            # Whichever sample lost its place is dropped along with its ground-level images
+            record_row(changes, item[2], None)
+    if boundary is None:
+        boundary = index + 1
+
+    kept = sorted(passthrough + [item for reservoir in reservoirs.values() for item in reservoir])
+
+    tmp_path = f"{samples_path}.tmp"
+    out_pos = 0
+    new_offset = None
+    with open(tmp_path, "wb") as f_out:
+        for index, line, row in kept:
+            if new_offset is None and index >= boundary:
+                new_offset = out_pos
+            if row is not None:
+                record_row(changes, row, line.decode().strip().split(","))
+            f_out.write(line)
+            out_pos += len(line)
+    return tmp_path, out_pos if new_offset is None else new_offset
+
+def finish_rebalance(city_splits_path):
+    """Swap in whatever files an interrupted rebalance left behind, then its split state, returning whether there was one
+
+    Until this runs the split state may not match the files, so the split script calls it before reading either.
+    """
+    pending_path = os.path.join(city_splits_path, PENDING_FILE)
+    if not os.path.exists(pending_path):
+        return False
+    with open(pending_path, "r") as f:
+        pending = json.load(f)
+
+    # Files already swapped in have no temp file left
+    for file_name in pending["files"]:
+        path = os.path.join(city_splits_path, file_name)
+        if os.path.exists(f"{path}.tmp"):
+            os.replace(f"{path}.tmp", path)
+
+    if pending["state"] is not None:
+        state_path = os.path.join(city_splits_path, "split_state.json")
+        with open(f"{state_path}.tmp", "w") as f:
+            json.dump(pending["state"], f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    if os.path.exists(manifest.MANIFEST_PATH):
+        conn = manifest.connect()
+        manifest.migrate_city(conn, os.path.basename(city_splits_path))
+        conn.close()
+
+    os.remove(pending_path)
+    return True
+
+def rebalance_city(city, max_ground, max_per_cell, n_regions_side, seed):
+    """Cap one city's samples and bring its metadata, comp samples and splits in line"""
+    city_splits_path = os.path.join("dataset", "splits", city)
+    samples_path = os.path.join(city_splits_path, "samples.csv")
+    metadata_path = os.path.join(city_splits_path, "ground_metadata.csv")
+    state_path = os.path.join(city_splits_path, "split_state.json")
+    changes_path = os.path.join(city_splits_path, "rebalance_changes.sqlite")
+
+    # Rebalance from what an earlier interrupted run meant to leave, not from a mix of old and new files
+    finish_rebalance(city_splits_path)
+
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            state = json.load(f)
+
+    changes = open_changes(changes_path)
+    try:
+        rng = random.Random(f"{seed}:{city}")
+        samples_tmp, samples_offset = rebalance_samples(
+            samples_path, cities[city], max_ground, max_per_cell, n_regions_side, rng,
+            state["samples_offset"] if state else 0, changes,
+        )
+
+        (dropped,) = changes.execute("SELECT COUNT(*) FROM changed WHERE kept IS NULL").fetchone()
+        if changes.execute("SELECT 1 FROM changed LIMIT 1").fetchone() is None:
+            os.remove(samples_tmp)
+            return city, 0, 0
+
+        replacements = [(samples_tmp, samples_path)]
+
+        # Ground-level images can be shared between samples, so only forget ones nothing references anymore
+        changes.execute("CREATE TABLE orphaned AS SELECT name FROM removed WHERE name NOT IN (SELECT name FROM kept_ground)")
+        (orphaned,) = changes.execute("SELECT COUNT(*) FROM orphaned").fetchone()
+        if os.path.exists(metadata_path):
+            def drop_orphaned(line):
+                name = f"{line.split(b',', 1)[0].decode().strip()}.jpg"
+                return None if changes.execute("SELECT 1 FROM orphaned WHERE name = ?", [name]).fetchone() else line
+            metadata_tmp, _ = rewrite_file(metadata_path, drop_orphaned)
+            replacements.append((metadata_tmp, metadata_path))
+
+        def follow_samples(line):
+            row = line.decode().strip().split(",")
+            change = changes.execute("SELECT kept FROM changed WHERE aerial = ?", [row[0]]).fetchone()
+            if change is None:
+                return line
+            if change[0] is None:
+                return None
+            kept = set(change[0].split(","))
+            row = [row[0]] + [gl for gl in row[1:] if gl in kept]
+            if len(row) < 2:
+                return None
+            return (",".join(row) + "\n").encode()
+
+        for file_name in ROW_FILES:
+            path = os.path.join(city_splits_path, file_name)
+            if not os.path.exists(path):
+                continue
+            offset = state["comp_samples_offset"] if state and file_name == "comp_samples.csv" else None
+            tmp_path, new_offset = rewrite_file(path, follow_samples, offset)
+            replacements.append((tmp_path, path))
+            if offset is not None:
+                state["comp_samples_offset"] = new_offset
+    finally:
+        changes.close()
+        os.remove(changes_path)
+
+    if state:
+        state["samples_offset"] = samples_offset
+        # The split script cuts its outputs back to these sizes before appending
+        state["sizes"] = {
+            os.path.basename(path): os.path.getsize(tmp_path)
+            for tmp_path, path in replacements if os.path.basename(path) in ROW_FILES
+        }
+
+    # Each replace is atomic but the set isn't, so record the whole set first; finish_rebalance then swaps the
+    # files and writes the state that matches them, and repeats whatever a crash interrupts
+    pending_path = os.path.join(city_splits_path, PENDING_FILE)
+    with open(f"{pending_path}.tmp", "w") as f:
+        json.dump({"files": [os.path.basename(path) for _, path in replacements], "state": state}, f)
+    os.replace(f"{pending_path}.tmp", pending_path)
+    finish_rebalance(city_splits_path)
+
+    return city, dropped, orphaned
+
+def main():
+    """Cap ground-level images per sample, and optionally samples per grid cell, for every city in parallel."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--max-ground", type=int, default=GL_SAMPLES_MAX, help="Ground-level images kept per sample")
+    parser.add_argument("--max-per-cell", type=int, default=None, help="Samples kept per grid cell")
+    parser.add_argument("--regions", type=int, default=100, help="Grid cells per side for --max-per-cell")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    # Rows create_dataset.py appends during a rewrite are lost when the rewritten file replaces it,
+    # so this must not run alongside create_dataset.py
+    city_names = [
+        city for city in cities
+        if os.path.exists(os.path.join("dataset", "splits", city, "samples.csv"))
+    ]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(rebalance_city, city, args.max_ground, args.max_per_cell, args.regions, args.seed)
+            for city in city_names
+        ]
+        for future in as_completed(futures):
+            city, dropped_samples, orphaned_images = future.result()
+            print(f"{city}: dropped {dropped_samples} samples, {orphaned_images} ground-level images no longer referenced")
+
+    print("Run reconcile_dataset.py to delete image files that are no longer referenced")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import manifest
+from rebalance_dataset import ROW_FILES
+
+# Threads per city issuing deletes; removal is I/O bound
+DELETE_THREADS = 16
+
+def referenced_files(city_splits_path):
+    """Aerial and ground-level file names listed by samples.csv or any split file, built in one pass each"""
+    aerial = set()
+    ground = set()
+    for file_name in ["samples.csv"] + ROW_FILES:
+        for row in manifest.read_rows(os.path.join(city_splits_path, file_name)):
+            aerial.add(row[0])
+            ground.update(row[1:])
+    return aerial, ground
+
+def find_orphans(folder_path, referenced):
+    """Files in a folder that nothing references, with their sizes, plus how many referenced files exist"""
+    orphans = []
+    present = 0
+    if not os.path.isdir(folder_path):
+        return orphans, present
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name in referenced:
+                present += 1
+            else:
+                orphans.append((entry.path, entry.stat().st_size))
+    return orphans, present
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def reconcile_city(city, dry_run):
+    """Report, and unless dry_run delete, one city's unreferenced aerial and ground-level files"""
+    aerial = None
+    if os.path.exists(manifest.MANIFEST_PATH):
+        conn = manifest.connect()
+        if manifest.has_city(conn, city):
+            aerial, ground = manifest.referenced_files(conn, city)
+        conn.close()
+
+    # Deletes are only driven by the manifest when it holds the city's samples; otherwise read the CSVs
+    if not aerial:
+        aerial, ground = referenced_files(os.path.join("dataset", "splits", city))
+
+    report = {"city": city}
+    orphans = []
+    for kind, referenced in (("aerial", aerial), ("ground", ground)):
+        kind_orphans, present = find_orphans(os.path.join("dataset", city, kind), referenced)
+        orphans.extend(kind_orphans)
+        report[f"{kind}_orphans"] = len(kind_orphans)
+        report[f"{kind}_orphan_bytes"] = sum(size for _, size in kind_orphans)
+        report[f"{kind}_missing"] = len(referenced) - present
+
+    if not dry_run and orphans:
+        with ThreadPoolExecutor(max_workers=DELETE_THREADS) as executor:
+            list(executor.map(remove_quietly, (path for path, _ in orphans)))
+
+    return report
+
+def main():
+    """Find and delete aerial and ground-level files that no sample or split references, for every city in parallel."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--dry-run", action="store_true", help="Only report orphaned files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    # Images of in-flight samples aren't in samples.csv yet, so this must not run alongside create_dataset.py
+    city_names = [
+        city for city in os.listdir(os.path.join("dataset", "splits"))
+        if os.path.exists(os.path.join("dataset", "splits", city, "samples.csv"))
+    ]
+
+    total_files = 0
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(reconcile_city, city, args.dry_run) for city in city_names]
+        for future in as_completed(futures):
+            report = future.result()
+            print(
+                f"{report['city']}: "
+                f"{report['aerial_orphans']} orphaned aerial ({report['aerial_orphan_bytes'] / 1e6:.1f} MB), "
+                f"{report['ground_orphans']} orphaned ground ({report['ground_orphan_bytes'] / 1e6:.1f} MB), "
+                f"{report['aerial_missing']} aerial and {report['ground_missing']} ground referenced but missing"
+            )
+            total_files += report["aerial_orphans"] + report["ground_orphans"]
+            total_bytes += report["aerial_orphan_bytes"] + report["ground_orphan_bytes"]
+
+    action = "Would delete" if args.dry_run else "Deleted"
+    print(f"{action} {total_files} files, {total_bytes / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
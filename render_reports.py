@@ -0,0 +1,85 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import folium
+import numpy as np
+
+from create_train_val_test_split import create_split_map, load_region_labels
+from discrete_heatmap import N_REGIONS_SIDE, cities, color_cells, create_discrete_heatmap
+from grid_overlay import add_grid_overlay
+
+def render_city(city, n_regions_side, tile_zooms):
+    """Render a city's discrete heatmap and, once it has been split, its split map"""
+    city_splits_path = os.path.join("dataset", "splits", city)
+
+    cell_counts = create_discrete_heatmap(city, n_regions_side, tile_zooms)
+
+    if os.path.exists(os.path.join(city_splits_path, "comp_samples.csv")):
+        labels = load_region_labels(city, city_splits_path)
+        create_split_map(city, city_splits_path, labels)
+
+    return cell_counts
+
+def create_summary_map(city_counts, output_path):
+    """Combine the per-city count grids into one national map, colored on a single scale"""
+    m = folium.Map(location=[39.8, -98.6], zoom_start=4)
+
+    # One shared maximum, so a color means the same density in every city
+    max_count = max((cell_counts.max() for cell_counts in city_counts.values() if cell_counts.size), default=0)
+
+    counts_overlay = folium.FeatureGroup(name='Image Count Heatmap')
+    markers = folium.FeatureGroup(name='Cities')
+    for city, cell_counts in city_counts.items():
+        city_bounds = cities[city]
+        add_grid_overlay(counts_overlay, color_cells(cell_counts, max_count), city_bounds, city)
+        folium.Marker(
+            location=[(city_bounds[3] + city_bounds[1]) / 2, (city_bounds[2] + city_bounds[0]) / 2],
+            tooltip=(
+                f"{city}: max {int(cell_counts.max())} images per cell, "
+                f"{int(np.count_nonzero(cell_counts))} cells with images"
+            ),
+        ).add_to(markers)
+
+    counts_overlay.add_to(m)
+    markers.add_to(m)
+    folium.LayerControl().add_to(m)
+    m.save(output_path)
+
+def main():
+    """Render heatmaps and split maps for every city in parallel, then a national summary map."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of cities rendered at once")
+    parser.add_argument("--regions", type=int, default=N_REGIONS_SIDE, help="Heatmap grid cells per side")
+    parser.add_argument(
+        "--tiles", type=int, nargs=2, metavar=("MIN_ZOOM", "MAX_ZOOM"),
+        help="Write multi-resolution heatmap tiles for these zoom levels instead of a single image overlay",
+    )
+    args = parser.parse_args()
+    tile_zooms = range(args.tiles[0], args.tiles[1] + 1) if args.tiles else None
+
+    city_names = [
+        city for city in cities
+        if os.path.exists(os.path.join("dataset", "splits", city, "samples.csv"))
+    ]
+
+    city_counts = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(render_city, city, args.regions, tile_zooms): city
+            for city in city_names
+        }
+        for future in as_completed(futures):
+            city = futures[future]
+            try:
+                city_counts[city] = future.result()
+            except Exception as e:
+                print(f"Failed to render {city}: {e}")
+
+    if city_counts:
+        output_path = os.path.join("dataset", "summary_heatmap.html")
+        create_summary_map(dict(sorted(city_counts.items())), output_path)
+        print(f"Summary map saved to: {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+import manifest
+
+# Cached arrays live next to the CSV they were parsed from
+CACHE_DIR = ".cache"
+
+def file_signature(path):
+    """Size and modification time, used to invalidate anything parsed from a file"""
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def cache_path(path, name):
+    return os.path.join(os.path.dirname(path), CACHE_DIR, f"{os.path.basename(path)}.{name}.npz")
+
+def load_cached(path, name, key):
+    """Return a cached array for a file if its signature and key still match, else None"""
+    cached_path = cache_path(path, name)
+    if not os.path.exists(cached_path):
+        return None
+    try:
+        with np.load(cached_path) as cached:
+            if np.array_equal(cached["signature"], file_signature(path)) and np.array_equal(cached["key"], key):
+                return cached["value"]
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+def save_cached(path, name, key, value, signature):
+    """Write a cached array through a temp file so concurrent readers never see a partial cache"""
+    cached_path = cache_path(path, name)
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, signature=signature, key=key, value=value)
+    os.replace(tmp_path, cached_path)
+
+def load_sample_bboxes(samples_file):
+    """Parse the aerial bbox out of every sample's aerial filename into an (n, 4) array"""
+    bboxes = [manifest.parse_bbox(row[0]) for row in manifest.read_rows(samples_file)]
+    return np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+
+def cached_sample_bboxes(samples_file):
+    """load_sample_bboxes, reparsing only when the samples file has changed"""
+    key = np.zeros(0)
+    bboxes = load_cached(samples_file, "bboxes", key)
+    if bboxes is None:
+        signature = file_signature(samples_file)
+        bboxes = load_sample_bboxes(samples_file)
+        save_cached(samples_file, "bboxes", key, bboxes, signature)
+    return bboxes
+
+def cached_grid(samples_file, name, key, compute):
+    """Cache a per-city grid computed from the sample bboxes, keyed by the grid's parameters"""
+    key = np.asarray(key, dtype=np.float64)
+    grid = load_cached(samples_file, name, key)
+    if grid is None:
+        signature = file_signature(samples_file)
+        grid = compute(cached_sample_bboxes(samples_file))
+        save_cached(samples_file, name, key, grid, signature)
+    return grid
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+import manifest
+
+# Matches the exportImage size requested in create_dataset.py
+AERIAL_SIZE = (512, 512)
+
+QUARANTINE_PATH = os.path.join("dataset", "quarantine")
+
+# Files handed to each worker at a time; most are small, so batching keeps pool overhead down
+CHUNK_SIZE = 64
+
+def verify_file(path, folder):
+    """Hash and fully decode one image, returning (sha256, error), where error is None for a good file"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return None, f"unreadable: {e}"
+
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # open() only reads the header; load() decodes every pixel, so truncation shows up here
+            image.load()
+            size = image.size
+    except Exception as e:
+        return sha256, f"undecodable: {e}"
+
+    if folder == "aerial" and size != AERIAL_SIZE:
+        return sha256, f"aerial is {size[0]}x{size[1]}, expected {AERIAL_SIZE[0]}x{AERIAL_SIZE[1]}"
+    return sha256, None
+
+def verify_job(job):
+    city, folder, name, size, mtime_ns = job
+    sha256, error = verify_file(os.path.join("dataset", city, folder, name), folder)
+    return city, folder, name, size, mtime_ns, sha256, error
+
+def changed_files(conn, city, folder):
+    """Files in a city's folder that are new or whose size or mtime changed since they were last verified"""
+    folder_path = os.path.join("dataset", city, folder)
+    verified = manifest.verified_files(conn, city, folder)
+    jobs = []
+    present = set()
+    if os.path.isdir(folder_path):
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                # Skip in-progress downloads
+                if not entry.is_file() or entry.name.endswith(".part"):
+                    continue
+                present.add(entry.name)
+                stat = entry.stat()
+                if verified.get(entry.name, (None, None, None))[:2] != (stat.st_size, stat.st_mtime_ns):
+                    jobs.append((city, folder, entry.name, stat.st_size, stat.st_mtime_ns))
+
+    # Quarantined files keep their record so their samples stay flagged; deleted good ones are forgotten
+    gone = [name for name, (_, _, error) in verified.items() if name not in present and error is None]
+    return jobs, gone
+
+def quarantine(city, folder, name):
+    target_path = os.path.join(QUARANTINE_PATH, city, folder)
+    os.makedirs(target_path, exist_ok=True)
+    shutil.move(os.path.join("dataset", city, folder, name), os.path.join(target_path, name))
+
+def flag_samples(conn, city):
+    """Write flagged.csv listing each sample that references a bad file, returning how many samples it lists"""
+    bad = {}
+    for folder in ("aerial", "ground"):
+        for name, (_, _, error) in manifest.verified_files(conn, city, folder).items():
+            if error is not None:
+                bad[name] = error
+
+    city_splits_path = os.path.join("dataset", "splits", city)
+    flagged_path = os.path.join(city_splits_path, "flagged.csv")
+    flagged = set()
+    with open(f"{flagged_path}.tmp", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["aerial", "file", "error"])
+        for row in manifest.read_rows(os.path.join(city_splits_path, "samples.csv")):
+            for name in row:
+                if name in bad:
+                    writer.writerow([row[0], name, bad[name]])
+                    flagged.add(row[0])
+    os.replace(f"{flagged_path}.tmp", flagged_path)
+    return len(flagged)
+
+def main():
+    """Decode and hash every image in parallel, quarantining bad files and flagging the samples that use them."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("cities", nargs="*", help="Cities to verify (default: all under dataset/splits)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--no-quarantine", action="store_true", help="Record and flag bad files without moving them")
+    args = parser.parse_args()
+
+    city_names = args.cities or manifest.dataset_cities()
+
+    # A manifest created here gets every city, not only the ones being verified
+    conn = manifest.connect_complete()
+
+    jobs = []
+    for city in city_names:
+        for folder in ("aerial", "ground"):
+            city_jobs, gone = changed_files(conn, city, folder)
+            jobs.extend(city_jobs)
+            with conn:
+                manifest.forget_files(conn, city, folder, gone)
+    print(f"Verifying {len(jobs)} new or changed files")
+
+    checked = 0
+    bad_files = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = []
+        for result in executor.map(verify_job, jobs, chunksize=CHUNK_SIZE):
+            city, folder, name, size, mtime_ns, sha256, error = result
+            if error is not None:
+                bad_files += 1
+                print(f"{city}/{folder}/{name}: {error}")
+                if not args.no_quarantine:
+                    quarantine(city, folder, name)
+            results.append(result)
+            checked += 1
+
+            # Commit in batches so an interrupted run keeps what it already verified
+            if len(results) >= CHUNK_SIZE * 16:
+                with conn:
+                    manifest.record_files(conn, results)
+                results = []
+
+        with conn:
+            manifest.record_files(conn, results)
+
+    for city in city_names:
+        flagged = flag_samples(conn, city)
+        if flagged:
+            print(f"{city}: {flagged} samples flagged in flagged.csv")
+    conn.close()
+
+    print(f"Verified {checked} files, {bad_files} bad" + ("" if args.no_quarantine or not bad_files else f", moved to {QUARANTINE_PATH}"))
+
+if __name__ == "__main__":
+    main()